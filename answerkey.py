@@ -0,0 +1,319 @@
+"""
+Columnar answer keys.
+
+`export_answers` draws and solves every student of an assignment and
+writes each variable of each problem (inputs, solver outputs and
+extraneous inputs) as a column of ``.npy`` files, with a ``schema.json``
+describing them:
+
+    out/arithmetic-operations-answers/
+        schema.json
+        students.npy            student ids, one row per student
+        p0.assigned.npy         whether each student has problem 0
+        p0.w.values.npy         the values of all students, flattened
+        p0.w.offsets.npy        student i's values are values[offsets[i]:offsets[i+1]]
+        p0.w.shapes.npy         per student shapes (arrays of 2 or more dimensions only)
+        p0.w.units.npy          per student index into the column's units (quantities only)
+
+`AnswerKey` memory maps the files, so looking up one student or scanning
+one column of a large class reads only the pages it needs.
+
+    key = AnswerKey('out/arithmetic-operations-answers')
+    key.student(17)                       # {title: {name: value}}
+    key.column('Sum Two Numbers', 'w').scalars()
+
+A seeded assignment draws the same numbers for a student every time, so
+its answer key matches the LaTeX written by `output2latex`. An unseeded
+one draws from the global numpy.random state: write its key in the same
+run, adding each student to an `AnswerKeyWriter` as it is drawn.
+"""
+import json
+import os
+
+import numpy as np
+
+from quantity import Quantity, Unit, conversion_plan
+
+SCHEMA = 'schema.json'
+
+FORMAT = 1
+
+
+def answers_directory(assignment_title):
+    return f'out/{assignment_title.replace(" ","-").lower()}-answers'
+
+
+class _ColumnBuilder():
+    """The values of one variable of one problem, student by student."""
+
+    def __init__(self, role):
+        self.role = role
+        self.rows = []
+        self.values = []
+        self.units = {}
+        self.unit_codes = []
+
+    def add(self, row, value):
+        units = getattr(value, 'units', None)
+        self.rows.append(row)
+        self.values.append(np.asarray(value))
+        if units is not None:
+            self.unit_codes.append(self.units.setdefault(units, len(self.units)))
+        else:
+            self.unit_codes.append(-1)
+
+    def save(self, directory, prefix, number_students):
+        """Writes the column files, returns the column's schema."""
+        ndim = max(a.ndim for a in self.values)
+        if ndim > 0:
+            values = [a.reshape((1,)*(ndim - a.ndim) + a.shape) for a in self.values]
+        else:
+            values = self.values
+        counts = np.zeros(number_students, dtype=np.int64)
+        counts[self.rows] = [a.size for a in values]
+        offsets = np.zeros(number_students + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        flat = np.concatenate([a.ravel() for a in values])
+
+        schema = {'role': self.role,
+                  'dtype': flat.dtype.str,
+                  'ndim': ndim,
+                  'units': None,
+                  'values': f'{prefix}.values.npy',
+                  'offsets': f'{prefix}.offsets.npy'}
+        np.save(os.path.join(directory, schema['values']), flat)
+        np.save(os.path.join(directory, schema['offsets']), offsets)
+        if ndim > 1:
+            shapes = np.zeros((number_students, ndim), dtype=np.int64)
+            shapes[self.rows] = [a.shape for a in values]
+            schema['shapes'] = f'{prefix}.shapes.npy'
+            np.save(os.path.join(directory, schema['shapes']), shapes)
+        if self.units:
+            codes = np.full(number_students, -1, dtype=np.int32)
+            codes[self.rows] = self.unit_codes
+            schema['units'] = [dict(u) for u in self.units]
+            schema['unit_codes'] = f'{prefix}.units.npy'
+            np.save(os.path.join(directory, schema['unit_codes']), codes)
+        return schema
+
+
+class AnswerKeyWriter():
+    """
+    Collects the solved problems of students as they are drawn and writes
+    them as an answer key on `close` (or on leaving a ``with`` block).
+    """
+
+    def __init__(self, assignment, directory=None):
+        self.assignment = assignment
+        self.directory = directory or answers_directory(assignment.title)
+        self.students = []
+        self._columns = {}
+
+    def add(self, student_id, problems, views):
+        """
+        Adds a student, its `problems` (the Problems of its subset) and
+        the `views` drawn for them, e.g. from `outputroutines.draw`.
+        """
+        row = len(self.students)
+        self.students.append(student_id)
+        for prob, view in zip(problems, views):
+            index = self.assignment.problems.index(prob)
+            inputs = {v.name for v in prob.inputs}
+            extraneous = {v.name for v in prob.extraneous_inputs}
+            columns = self._columns.setdefault(index, {})
+            for name, var in view.dct.items():
+                if name not in columns:
+                    role = ('input' if name in inputs
+                            else 'extraneous' if name in extraneous
+                            else 'output')
+                    columns[name] = _ColumnBuilder(role)
+                columns[name].add(row, var.value)
+
+    def close(self):
+        """Writes the files and the schema, returns the directory."""
+        directory = self.directory
+        os.makedirs(directory, exist_ok=True)
+        number_students = len(self.students)
+        students = np.array(self.students, dtype=np.int64)
+        np.save(os.path.join(directory, 'students.npy'), students)
+        problems = []
+        for index in sorted(self._columns):
+            prob = self.assignment.problems[index]
+            columns = self._columns[index]
+            assigned = np.zeros(number_students, dtype=bool)
+            for column in columns.values():
+                assigned[column.rows] = True
+            np.save(os.path.join(directory, f'p{index}.assigned.npy'), assigned)
+            problems.append({'index': index,
+                             'title': prob.title,
+                             'points': prob.points,
+                             'difficulty': prob.difficulty,
+                             'assigned': f'p{index}.assigned.npy',
+                             'columns': {name: column.save(directory, f'p{index}.{name}',
+                                                           number_students)
+                                         for name, column in columns.items()}})
+        schema = {'format': FORMAT,
+                  'assignment': self.assignment.title,
+                  'seed': self.assignment.seed,
+                  'students': number_students,
+                  'sorted': bool(np.all(students[1:] > students[:-1])),
+                  'problems': problems}
+        tmp = os.path.join(directory, f'{SCHEMA}.{os.getpid()}.tmp')
+        with open(tmp, 'w') as _:
+            json.dump(schema, _, indent=1)
+        os.replace(tmp, os.path.join(directory, SCHEMA))
+        return directory
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+
+
+def export_answers(assignment, number_students, directory=None, cohort=False,
+                   students=None):
+    """
+    Draws and solves each student (all of ``range(number_students)`` by
+    default, see `outputroutines.draw`) and writes the answer key to
+    `directory`. Returns the directory.
+    """
+    from outputroutines import draw
+    if students is None:
+        students = range(number_students)
+    with AnswerKeyWriter(assignment, directory) as writer:
+        for n, views in draw(assignment, students, cohort):
+            writer.add(n, assignment.subset_for(n), views)
+    return writer.directory
+
+
+class Column():
+    """One variable of one problem across the class, memory mapped."""
+
+    def __init__(self, key, schema):
+        self.role = schema['role']
+        self.ndim = schema['ndim']
+        self.values = key._load(schema['values'])
+        self.offsets = key._load(schema['offsets'])
+        self.shapes = key._load(schema['shapes']) if 'shapes' in schema else None
+        if schema['units'] is None:
+            self.units = None
+            self.unit_codes = None
+        else:
+            self.units = [Unit.intern(u) for u in schema['units']]
+            self.unit_codes = key._load(schema['unit_codes'])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        """The value of the student in `row`, a Quantity if it has units."""
+        value = np.array(self.values[self.offsets[row]:self.offsets[row + 1]])
+        if self.ndim == 0:
+            value = value.reshape(())
+        elif self.shapes is not None:
+            value = value.reshape(self.shapes[row])
+        if self.units is not None and self.unit_codes[row] >= 0:
+            return Quantity._from_trusted(value.astype(float, copy=False),
+                                          self.units[self.unit_codes[row]])
+        return value
+
+    def scalars(self, units=None, fill=np.nan):
+        """
+        The single value of every student as one array, converted to
+        `units` (a unit string, dict or `Unit`, SI if None) for a column
+        of quantities. Students without the problem get `fill`. Raises
+        ValueError unless every student has at most one value.
+        """
+        counts = np.diff(self.offsets)
+        if counts.max(initial=0) > 1:
+            raise ValueError('the column has more than one value per student')
+        present = counts == 1
+        if self.values.dtype.kind not in 'biuf':
+            out = np.full(len(self), fill, dtype=object)
+        else:
+            out = np.full(len(self), fill,
+                          dtype=np.result_type(self.values.dtype, np.float64))
+        out[present] = self.values[self.offsets[:-1][present]]
+        if self.units is not None:
+            factors = np.array([conversion_plan(u, units).factor for u in self.units])
+            codes = self.unit_codes[present]
+            # code -1, a value without units, is left as it is
+            out[present] *= np.append(factors, 1.)[codes]
+        return out
+
+
+class AnswerKey():
+    """
+    An answer key written by `export_answers`. Files are memory mapped
+    when first used.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, SCHEMA)) as _:
+            self.schema = json.load(_)
+        if self.schema['format'] != FORMAT:
+            raise ValueError(f'unknown answer key format {self.schema["format"]}')
+        self._arrays = {}
+        self._columns = {}
+        self._rows = None
+        self.students = self._load('students.npy')
+        self.problems = {p['title']: p for p in self.schema['problems']}
+
+    def _load(self, name):
+        try:
+            return self._arrays[name]
+        except KeyError:
+            a = self._arrays[name] = np.load(os.path.join(self.directory, name),
+                                             mmap_mode='r')
+            return a
+
+    def row(self, student_id):
+        """The row of a student, raises KeyError if it is not in the key."""
+        if self.schema['sorted']:
+            i = int(np.searchsorted(self.students, student_id))
+            if i < len(self.students) and self.students[i] == student_id:
+                return i
+            raise KeyError(student_id)
+        if self._rows is None:
+            self._rows = {int(n): i for i, n in enumerate(self.students)}
+        return self._rows[student_id]
+
+    def rows(self, student_ids):
+        """The rows of an array of student ids, -1 for ids not in the key."""
+        student_ids = np.asarray(student_ids, dtype=np.int64)
+        if not self.schema['sorted']:
+            if self._rows is None:
+                self._rows = {int(n): i for i, n in enumerate(self.students)}
+            return np.array([self._rows.get(int(n), -1) for n in student_ids],
+                            dtype=np.int64)
+        rows = np.searchsorted(self.students, student_ids)
+        found = rows < len(self.students)
+        found[found] = self.students[rows[found]] == student_ids[found]
+        return np.where(found, rows, -1)
+
+    def assigned(self, problem):
+        """Whether each student has `problem` (a title)."""
+        return self._load(self.problems[problem]['assigned'])
+
+    def column(self, problem, name):
+        """The `Column` of variable `name` of `problem` (a title)."""
+        key = (problem, name)
+        if key not in self._columns:
+            self._columns[key] = Column(self, self.problems[problem]['columns'][name])
+        return self._columns[key]
+
+    def student(self, student_id):
+        """
+        ``{title: {name: value}}`` of the problems of a student. Raises
+        KeyError for a student not in the key.
+        """
+        row = self.row(student_id)
+        return {title: {name: self.column(title, name)[row] for name in p['columns']}
+                for title, p in self.problems.items()
+                if self.assigned(title)[row]}
+
+    def __len__(self):
+        return len(self.students)
@@ -0,0 +1,330 @@
+"""
+Benchmarks of the hot paths, run with ``python bench.py``.
+
+Every benchmark returns records ``{'bench', 'case', 'n', 'seconds'}``, the
+best time of a few repeats for `n` operations. ``--json PATH`` writes them
+with the versions and machine they were measured on, so runs can be
+compared over time. Nothing needs network access or a TeX install: the
+end-to-end run compiles with a stub pdflatex.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from importlib.metadata import version
+from types import SimpleNamespace
+
+import numpy as np
+
+from unitparse import compile_units, eval_units, parse_units_pyparsing, unit_cache_clear
+
+UNIT_STRINGS = ('m*s^-2',
+                'GPa',
+                'kg*m/s^2',
+                '(kg/m)*(m/s)',
+                '(kg*m)^1.5/s',
+                '(kg/m/ft)*BTU^2^3')
+
+STUDENTS = (10, 100, 1000, 10000)
+
+STUB_PDFLATEX = (
+    '#!/bin/sh\n'
+    'for arg; do case $arg in\n'
+    '    -output-directory=*) dir=${arg#*=};;\n'
+    '    -*) ;;\n'
+    '    *) tex=$arg;;\n'
+    'esac; done\n'
+    'name=$(basename "$tex" .tex)\n'
+    'echo "%PDF" > "$dir/$name.pdf"\n'
+    'echo "log" > "$dir/$name.log"\n')
+
+
+def best(fn, number, repeat=3):
+    """Best of `repeat` timings of `number` calls of `fn`, in seconds."""
+    return min(timeit.repeat(fn, number=number, repeat=repeat))
+
+
+def record(bench, case, n, seconds):
+    return {'bench': bench, 'case': str(case), 'n': n, 'seconds': seconds}
+
+
+def bench_unitparse(number=2000):
+    """Seconds per parse for the compiler and the pyparsing grammar.
+
+    Both parsers are called directly, bypassing the `eval_units` cache.
+    """
+    results = {}
+    for s in UNIT_STRINGS:
+        results[s] = {
+            'compiler': timeit.timeit(lambda: compile_units(s), number=number)/number,
+            'pyparsing': timeit.timeit(lambda: parse_units_pyparsing(s), number=number)/number,
+            }
+    return results
+
+
+def bench_eval_units(number=2000):
+    """`eval_units` on a cold cache (parse every call) and a warm one."""
+    records = []
+    for s in UNIT_STRINGS:
+        def cold():
+            unit_cache_clear()
+            eval_units(s)
+        records.append(record('eval_units', f'cold {s}', number, best(cold, number)))
+        eval_units(s)
+        records.append(record('eval_units', f'warm {s}', number,
+                              best(lambda: eval_units(s), number)))
+    return records
+
+
+def bench_quantity(number=2000, sizes=(1, 1000)):
+    """
+    Quantity arithmetic and unit conversion on scalars and arrays. The
+    conversion cases include copying the Quantity (timed as `copy`).
+    """
+    from quantity import Quantity
+    records = []
+    for size in sizes:
+        a = Quantity(np.random.random(size) + 1, 'kg*m/s^2')
+        b = Quantity(np.random.random(size) + 1, 'kg*m/s^2')
+        c = Quantity(np.random.random(size) + 1, 's')
+        cases = {'add': lambda: a + b,
+                 'mul': lambda: a*c,
+                 'div': lambda: a/c,
+                 'pow': lambda: c**2,
+                 # conversions are in place, so convert a fresh copy each call
+                 'copy': lambda: a.copy(),
+                 'convert_to_SI': lambda: a.copy().convert_to_SI(),
+                 'convert_to_unit': lambda: a.copy().convert_to_unit('lbf')}
+        for case, fn in cases.items():
+            records.append(record('quantity', f'{case} size={size}', number,
+                                  best(fn, number)))
+    return records
+
+
+def bench_conversion(number=200, count=1000):
+    """
+    Converting `count` scalar quantities one by one and with `convert_all`
+    (both including copying them, timed as `copy`), and an array of
+    `count` values with `convert_values`.
+    """
+    from quantity import Quantity, convert_all, convert_values
+    quantities = [Quantity(1., u) for u in ('km/hr', 'm/s', 'ft/s', 'mi/hr')*(count//4)]
+    values = np.random.random(count)
+    # conversions are in place, so convert fresh copies each call
+    cases = {'copy': lambda: [q.copy() for q in quantities],
+             'convert_to_unit loop': lambda: [q.copy().convert_to_unit('m/s')
+                                              for q in quantities],
+             'convert_all': lambda: convert_all([q.copy() for q in quantities], 'm/s'),
+             'convert_values': lambda: convert_values(values, 'km/hr', 'm/s')}
+    return [record('conversion', f'{case} count={count}', number*count,
+                   best(fn, number)) for case, fn in cases.items()]
+
+
+def bench_quantity_allocations(number=1000, sizes=(1, 1000)):
+    """
+    Memory blocks and bytes allocated per Quantity operation and still
+    held by its result, traced with tracemalloc. Records carry `blocks`
+    and `bytes` per operation instead of a time.
+    """
+    from quantity import Quantity
+    records = []
+    for size in sizes:
+        a = Quantity(np.random.random(size) + 1, 'kg*m/s^2')
+        b = Quantity(np.random.random(size) + 1, 'kg*m/s^2')
+        c = Quantity(np.random.random(size) + 1, 's')
+        cases = {'add': lambda: a + b,
+                 'mul': lambda: a*c,
+                 'div': lambda: a/c,
+                 'rsub': lambda: 1 - a,
+                 'rdiv': lambda: 1/a,
+                 'neg': lambda: -a,
+                 'imul': lambda: a.__imul__(1.)}
+        for case, fn in cases.items():
+            fn()
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            results = [fn() for _ in range(number)]
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            diff = [d for d in after.compare_to(before, 'filename')
+                    if not d.traceback[0].filename.endswith('tracemalloc.py')]
+            blocks = sum(d.count_diff for d in diff)
+            size_diff = sum(d.size_diff for d in diff)
+            del results
+            records.append({**record('quantity allocations', f'{case} size={size}',
+                                     number, None),
+                            'blocks': blocks/number, 'bytes': size_diff/number})
+    return records
+
+
+def bench_prec_round(sizes=(10, 1000, 100000)):
+    """`prec_round` on random arrays of several sizes."""
+    from utils import prec_round
+    records = []
+    for size in sizes:
+        a = np.random.standard_normal(size)*10.**np.random.randint(-5, 5, size)
+        number = max(1, 100000//size)
+        records.append(record('prec_round', f'size={size}', number,
+                              best(lambda: prec_round(a, 3), number)))
+    return records
+
+
+def bench_random_unit(number=2000):
+    """`RandomUnit.rng` over unit sets of a few dimensions."""
+    from problem import RandomUnit
+    records = []
+    for unit in ('m', 'kg*m/s^2', 'GPa'):
+        u = RandomUnit.from_unit_dimensionality(unit)
+        records.append(record('RandomUnit.rng', f'{unit} ({len(u.unit_set)} units)',
+                              number, best(u.rng, number)))
+    return records
+
+
+def synthetic_bank(size, seed=0):
+    """Stand-ins with the points and titles of a bank of `size` problems."""
+    g = np.random.default_rng(seed)
+    return tuple(SimpleNamespace(title=f'Problem {i}', points=int(p))
+                 for i, p in enumerate(g.choice([1, 2, 2, 3, 4, 5, 6, 8, 10], size)))
+
+
+def bench_assignment_rng(sizes=(50, 200, 800), num_problems=10):
+    """`Assignment.rng` on synthetic banks with a points window."""
+    from problem import Assignment
+    records = []
+    for size in sizes:
+        bank = synthetic_bank(size)
+        mean = np.mean([p.points for p in bank])*num_problems
+        ass = Assignment(bank, f'Bank {size}', seed=0)
+        for window in ('wide', 'tight'):
+            low, high = (0, 10**5) if window == 'wide' else (int(mean), int(mean))
+            fn = lambda: ass.rng(num_problems, low, high)
+            records.append(record('Assignment.rng',
+                                  f'{window} bank={size} k={num_problems}', 10,
+                                  best(fn, 10)))
+    return records
+
+
+def bench_output2latex(students=STUDENTS, workers=1):
+    """
+    End to end: draw, solve, render and write every student of a seeded
+    assignment, then compile with a stub pdflatex.
+    """
+    import dbprobs
+    from problem import Assignment
+    from outputroutines import latex2pdf, output2latex
+    records = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        pdflatex = os.path.join(tmp, 'pdflatex')
+        with open(pdflatex, 'w') as _:
+            _.write(STUB_PDFLATEX)
+        os.chmod(pdflatex, stat.S_IRWXU)
+        os.chdir(tmp)
+        try:
+            for n in students:
+                os.makedirs('out', exist_ok=True)
+                for ass in (dbprobs.A01, dbprobs.A03):
+                    seeded = Assignment(ass.problems, ass.title, seed=0)
+                    seeded.rng(len(seeded))
+                    start = time.perf_counter()
+                    names = output2latex(seeded, n, workers=workers)
+                    written = time.perf_counter()
+                    latex2pdf(names, pdflatex=pdflatex)
+                    done = time.perf_counter()
+                    records.append(record('output2latex', f'{ass.title} students={n}',
+                                          n, written - start))
+                    records.append(record('latex2pdf stub', f'{ass.title} students={n}',
+                                          n, done - written))
+                shutil.rmtree('out')
+        finally:
+            os.chdir(cwd)
+    return records
+
+
+def bench_grader(students=2000):
+    """
+    Exporting the answer key of a seeded class and grading one right
+    answer per output of every student against it.
+    """
+    import dbprobs
+    from answerkey import AnswerKey, export_answers
+    from grader import grade
+    from problem import Assignment
+    ass = Assignment((dbprobs.P01, dbprobs.P04, dbprobs.P05, dbprobs.P07, dbprobs.P10),
+                     'Grading', seed=0)
+    ass.rng(len(ass))
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        key = AnswerKey(export_answers(ass, students, tmp, cohort=True))
+        exported = time.perf_counter()
+        submissions = [(n, title, name, key.column(title, name)[n])
+                       for title, p in key.problems.items()
+                       for name, c in p['columns'].items() if c['role'] == 'output'
+                       for n in range(students)]
+        seconds = best(lambda: grade(key, submissions), 1)
+    return [record('answer key', f'export students={students}', students,
+                   exported - start),
+            record('grade', f'students={students} answers={len(submissions)}',
+                   students, seconds)]
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+                                ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'quantities': version('quantities'),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+
+def run(students=STUDENTS, workers=1):
+    records = []
+    for s, t in bench_unitparse().items():
+        for parser, seconds in t.items():
+            records.append(record('unitparse', f'{parser} {s}', 1, seconds))
+    records += bench_eval_units()
+    records += bench_quantity()
+    records += bench_conversion()
+    records += bench_quantity_allocations()
+    records += bench_prec_round()
+    records += bench_random_unit()
+    records += bench_assignment_rng()
+    records += bench_output2latex(students, workers)
+    records += bench_grader()
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--students', type=int, nargs='+', default=STUDENTS)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    records = run(args.students, args.workers)
+    print(f'{"bench":18s}{"case":44s}{"per op":>12s}')
+    for r in records:
+        if r['seconds'] is None:
+            print(f'{r["bench"]:18s}{r["case"]:44s}{r["blocks"]:6.1f} blocks{r["bytes"]:8.0f} B')
+        else:
+            print(f'{r["bench"]:18s}{r["case"]:44s}{r["seconds"]/r["n"]*1e6:10.1f}us')
+    if args.json:
+        with open(args.json, 'w') as _:
+            json.dump({'meta': metadata(), 'results': records}, _, indent=1)
+        print(f'wrote {args.json}', file=sys.stderr)
@@ -16,7 +16,9 @@ P01 = Problem(title = 'Sum Two Numbers',
         inputs = (RandomInteger('x',1,10),RandomInteger('y',1,10)),
         extraneous_inputs = (RandomInteger('z',-100,100),),
         solver = solver,
-        solution = 'The sum of ${x}$ and ${y}$ is ${w}$'
+        solution = 'The sum of ${x}$ and ${y}$ is ${w}$',
+        batch = True,
+        cacheable = True
         )
 
 def solver(x,y):
@@ -30,7 +32,9 @@ P02 = Problem(title = 'Subtract Two Numbers',
         inputs = (RandomInteger('x',1,10),RandomInteger('y',1,10)),
         extraneous_inputs = (RandomInteger('z',-100,100),),
         solver = solver,
-        solution = 'The difference of ${x}$ and ${y}$ is ${w}$'
+        solution = 'The difference of ${x}$ and ${y}$ is ${w}$',
+        batch = True,
+        cacheable = True
         )
 
 def solver(x,y):
@@ -44,7 +48,9 @@ P03 = Problem(title = 'Multiply Two Numbers',
         inputs = (RandomInteger('x',1,10),RandomInteger('y',1,10)),
         extraneous_inputs = (RandomInteger('z',-100,100),),
         solver = solver,
-        solution = 'The product of ${x}$ and ${y}$ is ${w}$'
+        solution = 'The product of ${x}$ and ${y}$ is ${w}$',
+        batch = True,
+        cacheable = True
         )
 
 def solver(x,y):
@@ -58,7 +64,9 @@ P04 = Problem(title = 'Divide Two Numbers',
         inputs = (RandomInteger('x',1,10),RandomInteger('y',1,10)),
         extraneous_inputs = (RandomInteger('z',-100,100),),
         solver = solver,
-        solution = 'The quotient of ${x}$ and ${y}$ is ${w}$'
+        solution = 'The quotient of ${x}$ and ${y}$ is ${w}$',
+        batch = True,
+        cacheable = True
         )
 
 from numpy import cumsum
@@ -73,7 +81,8 @@ P05 = Problem(title = 'Sum Several Numbers Cumulatively',
         inputs = (RandomInteger('x',1,10,size=((6,8,10),)),), # has randomized size
         extraneous_inputs = tuple(),
         solver=solver,
-        solution = 'The cumulative sum is $$\\text{{cumsum}}({x_autofmt}) = {w_autofmt}\,.$$'
+        solution = 'The cumulative sum is $$\\text{{cumsum}}({x_autofmt}) = {w_autofmt}\,.$$',
+        cacheable=True
         )
 
 def solver(x):
@@ -87,7 +96,8 @@ P06 = Problem(title = 'Sum Along Several Columns Cumulatively',
         inputs = (RandomInteger('x',1,10,size=(6,6)),),
         extraneous_inputs = tuple(),
         solver=solver,
-        solution = 'The cumulative sum is $$\\text{{cumsum}}({x_autofmt}) = {w_autofmt}\,.$$'
+        solution = 'The cumulative sum is $$\\text{{cumsum}}({x_autofmt}) = {w_autofmt}\,.$$',
+        cacheable=True
         )
 
 import numpy as np
@@ -108,7 +118,9 @@ P07 = Problem(title = 'Acceleration for an Object Starting at Rest',
                   RandomQuantity('g',9.81,9.81,precision=3,unit=ConstantUnit('m*s^-2'))),
         extraneous_inputs = tuple(),
         solver=solver,
-        solution= 'After ${t}$ ${t.unit}$ the object has fallen ${x}$ ${x.unit}$.'
+        solution= 'After ${t}$ ${t.unit}$ the object has fallen ${x}$ ${x.unit}$.',
+        batch=True,
+        cacheable=True
         )
 
 def solver(x, y):
@@ -138,7 +150,9 @@ P10 = Problem(title = 'Evaluate the Poisson\'s ratio',
             RandomQuantity('G', 62.4, 79.0, precision=3,unit=ConstantUnit('GPa'))),
         extraneous_inputs = tuple(),
         solver=solver,
-        solution = 'The Poisson\'s ratio is $E/(2G) - 1$ = {n}.')
+        solution = 'The Poisson\'s ratio is $E/(2G) - 1$ = {n}.',
+        batch=True,
+        cacheable=True)
 
 A01 = Assignment( (P01,P02,P03,P04), title='Arithmetic Operations')
 A02 = Assignment( (P05,P06), title='Several Arithmetic Operations')
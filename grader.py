@@ -0,0 +1,245 @@
+"""
+Grading submitted answers against an answer key.
+
+Submissions are rows of (student id, problem title, output name, value,
+units), given as a dict of columns or as a list of records:
+
+    submissions = {'student': [0, 0, 1],
+                   'problem': ['Sum Two Numbers']*3,
+                   'name': ['w', 'w', 'w'],
+                   'value': [7, 8, 11],
+                   'units': [None, None, None]}
+    grades = grade(AnswerKey('out/arithmetic-operations-answers'), submissions)
+    grades.scores
+
+Answers are compared in SI units with ``np.isclose(submitted, expected,
+rtol, atol)``, all submissions of one output of one problem at once.
+Submitted units are converted with `quantity.conversion_plan`; a value
+without units is taken to be in the units of the student's own solution,
+and one in units of another dimension (or unknown units, or any units
+but dimensionless ones for a plain number) is wrong. If a student
+answers the same output twice the last answer counts. What became of
+each submission is in ``Grades.status``.
+
+Each problem is worth its points, shared equally among its solver
+outputs. Problems without outputs cannot be graded and are worth nothing.
+"""
+import tempfile
+
+import numpy as np
+
+from answerkey import AnswerKey, export_answers
+from quantity import DIMENSIONLESS, UnknownUnitError, conversion_plan
+from unitparse import UnitParseError
+
+COLUMNS = ('student', 'problem', 'name', 'value', 'units')
+
+STATUS = ('correct', 'incorrect', 'bad units', 'not assigned',
+          'unknown output', 'unknown student')
+
+
+def submission_columns(submissions):
+    """
+    The submissions as a dict of equal length columns, `COLUMNS`. A
+    record may be a tuple in that order or a dict, with or without units;
+    a Quantity value brings its own units.
+    """
+    if isinstance(submissions, dict):
+        columns = {k: list(submissions[k]) for k in COLUMNS if k in submissions}
+    else:
+        columns = {k: [] for k in COLUMNS}
+        for record in submissions:
+            if not isinstance(record, dict):
+                record = dict(zip(COLUMNS, record))
+            for k in COLUMNS:
+                columns[k].append(record.get(k))
+    size = len(columns['student'])
+    units = columns.get('units') or [None]*size
+    values = columns['value']
+    for i, value in enumerate(values):
+        if units[i] is None and hasattr(value, 'units'):
+            units[i] = value.units
+    columns['units'] = units
+    if any(len(columns[k]) != size for k in COLUMNS):
+        raise ValueError('submission columns differ in length')
+    return columns
+
+
+class Grades():
+    """
+    Points earned by each student (rows, in `students` order) on each
+    problem (columns, in `problems` order), out of `possible`.
+    """
+
+    def __init__(self, students, problems, earned, possible, correct, status):
+        self.students = students
+        self.problems = problems
+        self.earned = earned
+        self.possible = possible
+        # {(problem, output): bool array over students}
+        self.correct = correct
+        # one of STATUS for each submission, in order
+        self.status = status
+
+    @property
+    def scores(self):
+        return self.earned.sum(axis=1)
+
+    @property
+    def out_of(self):
+        return self.possible.sum(axis=1)
+
+    def student(self, student_id):
+        """
+        ``{title: (earned, possible)}`` of a student's problems. Raises
+        KeyError for a student not in the answer key.
+        """
+        found = np.flatnonzero(self.students == student_id)
+        if not len(found):
+            raise KeyError(student_id)
+        i = int(found[0])
+        return {p: (self.earned[i, j], self.possible[i, j])
+                for j, p in enumerate(self.problems) if self.possible[i, j]}
+
+
+def _scalar(value):
+    """A submitted value as a float, NaN unless it is one number."""
+    try:
+        a = np.asarray(value, dtype=float)
+    except (TypeError, ValueError):
+        return np.nan
+    return a.item() if a.size == 1 else np.nan
+
+
+def _unit_key(units):
+    if units is None or isinstance(units, str):
+        return units
+    return tuple(sorted(dict(units).items()))
+
+
+def _si_factors(units, column, rows):
+    """
+    The factors taking values submitted in `units` by the students in
+    `rows` to SI, NaN where the units do not fit the column.
+    """
+    factors = np.ones(len(units))
+    if column.units is None:
+        # a plain number: only dimensionless units fit
+        expected = np.ones(1)
+        codes = np.zeros(len(rows), dtype=np.intp)
+        dim = DIMENSIONLESS.dim
+    else:
+        # code -1, a value without units, is taken as SI
+        expected = np.append([conversion_plan(u).factor for u in column.units], 1.)
+        codes = column.unit_codes[rows]
+        dim = column.units[0].dim
+    groups = {}
+    for i, u in enumerate(units):
+        groups.setdefault(_unit_key(u), (u, []))[1].append(i)
+    for u, index in groups.values():
+        if u is None:
+            factors[index] = expected[codes[index]]
+            continue
+        try:
+            plan = conversion_plan(u)
+        except (UnknownUnitError, UnitParseError):
+            factors[index] = np.nan
+            continue
+        factors[index] = plan.factor if plan.units.dim == dim else np.nan
+    return factors
+
+
+def grade(key, submissions, rtol=1e-2, atol=0.):
+    """
+    Grades `submissions` (see `submission_columns`) against the
+    `AnswerKey` `key`, returns `Grades` for every student of the key.
+    `atol` is in SI units.
+
+    Submissions that cannot count are not errors but are flagged in
+    ``Grades.status``: 'bad units' (unknown units, or units of another
+    dimension, including any for a plain number), 'not assigned' (a
+    problem the student does not have), 'unknown output' (not a solver
+    output of a problem of the key) and 'unknown student'.
+    """
+    columns = submission_columns(submissions)
+    students = np.array(key.students)
+    problems = list(key.problems)
+    outputs = {title: [name for name, c in p['columns'].items() if c['role'] == 'output']
+               for title, p in key.problems.items()}
+
+    answered = {(title, name): np.zeros(len(students), dtype=bool)
+                for title in problems for name in outputs[title]}
+    rows = key.rows(np.array(columns['student'], dtype=np.int64))
+    status = np.full(len(rows), 'unknown output', dtype=object)
+    groups = {}
+    for i, (title, name) in enumerate(zip(columns['problem'], columns['name'])):
+        groups.setdefault((title, name), []).append(i)
+    for output, index in groups.items():
+        if output not in answered:
+            continue
+        index = np.array(index)
+        index = index[rows[index] >= 0]
+        column = key.column(*output)
+        r = rows[index]
+        values = [columns['value'][i] for i in index]
+        units = [columns['units'][i] for i in index]
+        factors = _si_factors(units, column, r)
+        if np.diff(column.offsets).max(initial=0) <= 1 and column.ndim <= 1:
+            submitted = np.array([_scalar(v) for v in values])*factors
+            ok = np.isclose(submitted, column.scalars()[r], rtol=rtol, atol=atol)
+        else:
+            ok = np.array([_close(v, f, column, n, rtol, atol)
+                           for v, f, n in zip(values, factors, r)], dtype=bool)
+        assigned = np.asarray(key.assigned(output[0]))[r]
+        ok &= assigned
+        answered[output][r] = ok
+        status[index] = np.where(ok, 'correct',
+                                 np.where(~assigned, 'not assigned',
+                                          np.where(np.isnan(factors), 'bad units',
+                                                   'incorrect')))
+    status[rows < 0] = 'unknown student'
+
+    earned = np.zeros((len(students), len(problems)))
+    possible = np.zeros((len(students), len(problems)))
+    for j, title in enumerate(problems):
+        if not outputs[title]:
+            continue
+        assigned = np.asarray(key.assigned(title))
+        points = key.problems[title]['points']
+        fraction = np.mean([answered[(title, name)] for name in outputs[title]], axis=0)
+        earned[:, j] = points*fraction*assigned
+        possible[:, j] = points*assigned
+    return Grades(students, problems, earned, possible, answered, status)
+
+
+def _close(value, factor, column, row, rtol, atol):
+    """One array valued answer, compared elementwise in SI units."""
+    expected = column[row]
+    units = getattr(expected, 'units', None)
+    if units is not None:
+        expected = np.asarray(expected)*conversion_plan(units).factor
+    try:
+        value = np.asarray(value, dtype=float)*factor
+    except (TypeError, ValueError):
+        return False
+    return (value.shape == expected.shape
+            and bool(np.isclose(value, expected, rtol=rtol, atol=atol).all()))
+
+
+def grade_assignment(assignment, number_students, submissions, rtol=1e-2, atol=0.,
+                     cohort=True):
+    """
+    Grades `submissions` by recomputing the answers of the students of the
+    class, ``range(number_students)``, who submitted (see
+    `answerkey.export_answers`); submissions of other students are flagged
+    'unknown student'. The assignment must be seeded, so that the answers
+    are those its students were given.
+    """
+    if assignment.seed is None:
+        raise ValueError('answers of an unseeded assignment cannot be recomputed')
+    columns = submission_columns(submissions)
+    students = sorted(set(int(n) for n in columns['student']
+                          if 0 <= n < number_students))
+    with tempfile.TemporaryDirectory() as tmp:
+        key = AnswerKey(export_answers(assignment, number_students, tmp, cohort, students))
+        return grade(key, columns, rtol, atol)
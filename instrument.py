@@ -0,0 +1,140 @@
+"""
+Per-stage timing of generation runs.
+
+The generation code wraps each stage (drawing, solving, rendering,
+writing, pdflatex) in ``instrument.span(stage, problem, student)``. Unless
+a run is being recorded that returns a shared do-nothing context manager,
+so the hooks cost a function call. To record a run:
+
+    with instrument.recording() as recorder:
+        output2pdf(A01, 100)
+    recorder.write_report('out/report.json')
+    print(recorder.format_report())
+
+Stages that run in worker processes are recorded there and sent back with
+the results.
+"""
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+_null = nullcontext()
+
+
+class NullRecorder():
+    """Records nothing, the recorder when no run is being recorded."""
+
+    enabled = False
+
+    def span(self, stage, problem=None, student=None):
+        return _null
+
+    def add(self, stage, seconds, problem=None, student=None):
+        pass
+
+    def extend(self, records):
+        pass
+
+    def drain(self):
+        return []
+
+
+class Recorder():
+    """
+    Keeps ``(stage, problem, student, seconds)`` records of every span.
+    `problem` is a problem title and `student` a student id, either None
+    when a span covers many.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def span(self, stage, problem=None, student=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append((stage, problem, student,
+                                 time.perf_counter() - start))
+
+    def add(self, stage, seconds, problem=None, student=None):
+        self.records.append((stage, problem, student, seconds))
+
+    def extend(self, records):
+        self.records.extend(records)
+
+    def drain(self):
+        """Returns and forgets the records, for a worker to send back."""
+        records, self.records = self.records, []
+        return records
+
+    def report(self, slowest=10):
+        """
+        Totals, counts and percentiles of the seconds of each stage, and
+        the `slowest` problems by their total time over all stages.
+        """
+        by_stage = {}
+        by_problem = {}
+        for stage, problem, student, seconds in self.records:
+            by_stage.setdefault(stage, []).append(seconds)
+            if problem is not None:
+                by_problem[problem] = by_problem.get(problem, 0.) + seconds
+        stages = {}
+        for stage, seconds in by_stage.items():
+            seconds = np.array(seconds)
+            stages[stage] = {'count': len(seconds),
+                             'total': float(seconds.sum()),
+                             'mean': float(seconds.mean()),
+                             **{f'p{q}': float(np.percentile(seconds, q))
+                                for q in PERCENTILES},
+                             'max': float(seconds.max())}
+        problems = sorted(by_problem.items(), key=lambda x: -x[1])[:slowest]
+        return {'stages': stages,
+                'slowest_problems': [{'problem': p, 'total': t} for p, t in problems]}
+
+    def format_report(self, slowest=10):
+        report = self.report(slowest)
+        lines = [f'{"stage":16s}{"count":>8s}{"total":>10s}'
+                 + ''.join(f'{"p" + str(q):>10s}' for q in PERCENTILES)
+                 + f'{"max":>10s}']
+        for stage, s in sorted(report['stages'].items(), key=lambda x: -x[1]['total']):
+            lines.append(f'{stage:16s}{s["count"]:8d}{s["total"]:9.3f}s'
+                         + ''.join(f'{s["p" + str(q)]*1e3:8.2f}ms' for q in PERCENTILES)
+                         + f'{s["max"]*1e3:8.2f}ms')
+        if report['slowest_problems']:
+            lines.append('')
+            lines.append('slowest problems')
+            for p in report['slowest_problems']:
+                lines.append(f'{p["total"]:9.3f}s  {p["problem"]}')
+        return '\n'.join(lines)
+
+    def write_report(self, path, slowest=10):
+        with open(path, 'w') as _:
+            json.dump(self.report(slowest), _, indent=1)
+
+
+recorder = NullRecorder()
+
+
+def span(stage, problem=None, student=None):
+    """Times the enclosed stage if a run is being recorded."""
+    return recorder.span(stage, problem, student)
+
+
+@contextmanager
+def recording(into=None):
+    """Records the stages run inside it into `into` (a new Recorder)."""
+    global recorder
+    previous = recorder
+    recorder = into if into is not None else Recorder()
+    try:
+        yield recorder
+    finally:
+        recorder = previous
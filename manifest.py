@@ -0,0 +1,298 @@
+"""
+Problem bank manifest.
+
+Finding the problems of a bank by importing it constructs every Random*
+variable (each draws in its constructor) and imports every solver. The
+manifest instead reads the metadata of each ``NAME = Problem(...)`` and
+``NAME = Assignment(...)`` at the top level of the bank modules from
+their source, and hands out `LazyProblem` proxies that import the module
+only when something other than the metadata is needed.
+
+    manifest = Manifest.open(['dbprobs'])
+    bank = manifest.problems(max_points=4, difficulty='easy')
+    A = Assignment(bank, 'Week 1', seed=2021)
+
+`Manifest.open` keeps the scan in a JSON file and rescans only the modules
+that changed since.
+"""
+import ast
+import importlib
+import importlib.util
+import json
+import os
+from collections import namedtuple
+
+METADATA = ('title', 'points', 'difficulty')
+
+ProblemEntry = namedtuple('ProblemEntry',
+                          'module name lineno title points difficulty')
+ProblemEntry.__doc__ = """
+Where a problem is defined (module, variable name and line) and its
+title, points and difficulty, None where the source does not give them as
+literals."""
+
+AssignmentEntry = namedtuple('AssignmentEntry', 'module name lineno title problems')
+AssignmentEntry.__doc__ = """
+Where an assignment is defined, its title and the variable names of its
+problems."""
+
+# a directory of its own: unitcache/ belongs to the unit registry snapshot
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'manifestcache', 'manifest.json')
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return None
+
+
+def _call_name(node):
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    return None
+
+
+def scan_module(module):
+    """
+    The problems and assignments defined at the top level of `module`,
+    read from its source without importing it.
+    """
+    spec = importlib.util.find_spec(module)
+    if spec is None or spec.origin is None:
+        raise ModuleNotFoundError(f'no module named {module!r}')
+    with open(spec.origin) as _:
+        tree = ast.parse(_.read(), spec.origin)
+    problems = []
+    assignments = []
+    for node in tree.body:
+        if not (isinstance(node, ast.Assign)
+                and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+                and isinstance(node.value, ast.Call)):
+            continue
+        name = node.targets[0].id
+        kind = _call_name(node.value)
+        kwargs = {k.arg: k.value for k in node.value.keywords}
+        if kind == 'Problem':
+            # Problem's positional order starts title, statement, difficulty, points
+            args = dict(zip(('title', 'statement', 'difficulty', 'points'),
+                            node.value.args))
+            kwargs = {**args, **kwargs}
+            problems.append(ProblemEntry(module, name, node.lineno,
+                                         *(_literal(kwargs[k]) if k in kwargs else None
+                                           for k in METADATA)))
+        elif kind == 'Assignment':
+            args = dict(zip(('problems', 'title'), node.value.args))
+            kwargs = {**args, **kwargs}
+            members = kwargs.get('problems')
+            if isinstance(members, (ast.Tuple, ast.List)):
+                members = tuple(x.id for x in members.elts if isinstance(x, ast.Name))
+            else:
+                members = None
+            title = _literal(kwargs['title']) if 'title' in kwargs else None
+            assignments.append(AssignmentEntry(module, name, node.lineno,
+                                               title, members))
+    return problems, assignments
+
+
+class LazyProblem():
+    """
+    Stands in for a Problem of the manifest: the title, points and
+    difficulty are known up front, anything else imports the problem's
+    module and is passed through to the Problem.
+    """
+
+    def __init__(self, entry):
+        object.__setattr__(self, 'entry', entry)
+        object.__setattr__(self, '_problem', None)
+
+    def load(self):
+        """The Problem, importing its module on first use."""
+        if self._problem is None:
+            module = importlib.import_module(self.entry.module)
+            object.__setattr__(self, '_problem', getattr(module, self.entry.name))
+        return self._problem
+
+    @property
+    def loaded(self):
+        return self._problem is not None
+
+    @property
+    def title(self):
+        return self.entry.title if self.entry.title is not None else self.load().title
+
+    @property
+    def points(self):
+        return self.entry.points if self.entry.points is not None else self.load().points
+
+    @property
+    def difficulty(self):
+        if self.entry.difficulty is not None:
+            return self.entry.difficulty
+        return self.load().difficulty
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __repr__(self):
+        return f'LazyProblem({self.entry.module}.{self.entry.name})'
+
+
+class Manifest():
+    """
+    The problems and assignments of some bank modules, queried without
+    importing them.
+    """
+
+    def __init__(self, problems, assignments, stamps=None):
+        self.entries = list(problems)
+        self.assignment_entries = list(assignments)
+        self.stamps = stamps or {}
+        self._proxies = {}
+
+    @classmethod
+    def build(cls, modules):
+        problems, assignments, stamps = [], [], {}
+        for module in modules:
+            p, a = scan_module(module)
+            problems += p
+            assignments += a
+            stamps[module] = _stamp(module)
+        return cls(problems, assignments, stamps)
+
+    @classmethod
+    def open(cls, modules, path=MANIFEST_PATH):
+        """
+        The manifest of `modules`, read from `path` when it is up to date
+        and otherwise rescanned (only the changed modules) and saved.
+        """
+        try:
+            cached = cls.load(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            cached = cls([], [])
+        problems, assignments, stamps = [], [], {}
+        for module in modules:
+            stamp = _stamp(module)
+            if cached.stamps.get(module) == stamp:
+                problems += [e for e in cached.entries if e.module == module]
+                assignments += [e for e in cached.assignment_entries if e.module == module]
+            else:
+                p, a = scan_module(module)
+                problems += p
+                assignments += a
+            stamps[module] = stamp
+        manifest = cls(problems, assignments, stamps)
+        if stamps != cached.stamps:
+            try:
+                manifest.save(path)
+            except OSError:
+                pass
+        return manifest
+
+    def save(self, path=MANIFEST_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as _:
+            json.dump({'stamps': self.stamps,
+                       'problems': [e._asdict() for e in self.entries],
+                       'assignments': [e._asdict() for e in self.assignment_entries]},
+                      _, indent=1)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=MANIFEST_PATH):
+        with open(path) as _:
+            d = json.load(_)
+        return cls([ProblemEntry(**e) for e in d['problems']],
+                   [AssignmentEntry(**{**e, 'problems': None if e['problems'] is None
+                                       else tuple(e['problems'])})
+                    for e in d['assignments']],
+                   {k: tuple(v) for k, v in d['stamps'].items()})
+
+    def proxy(self, entry):
+        """The one `LazyProblem` of `entry`."""
+        key = (entry.module, entry.name)
+        if key not in self._proxies:
+            self._proxies[key] = LazyProblem(entry)
+        return self._proxies[key]
+
+    def query(self, min_points=None, max_points=None, difficulty=None,
+              title=None, module=None):
+        """
+        The entries matching every given filter: points in
+        [min_points, max_points], `difficulty` and `module` equal (or in, if
+        a collection) and `title` a substring of the title.
+        """
+        def matches(value, wanted):
+            if wanted is None:
+                return True
+            if isinstance(wanted, str):
+                return value == wanted
+            return value in wanted
+
+        selected = []
+        for entry in self.entries:
+            proxy = self.proxy(entry)
+            if min_points is not None and proxy.points < min_points:
+                continue
+            if max_points is not None and proxy.points > max_points:
+                continue
+            if not matches(proxy.difficulty, difficulty):
+                continue
+            if not matches(entry.module, module):
+                continue
+            if title is not None and title not in proxy.title:
+                continue
+            selected.append(entry)
+        return selected
+
+    def problems(self, **query):
+        """`LazyProblem` proxies of the entries matching `query`."""
+        return tuple(self.proxy(e) for e in self.query(**query))
+
+    def assignment(self, name, module=None, seed=None):
+        """
+        The assignment defined as `name` (in `module`), over lazy proxies
+        of its problems so that nothing is imported before it is drawn.
+        """
+        from problem import Assignment
+        for entry in self.assignment_entries:
+            if entry.name == name and module in (None, entry.module):
+                break
+        else:
+            raise KeyError(name)
+        if entry.problems is None:
+            raise ValueError(f'the problems of {entry.module}.{name} are not '
+                             'a literal tuple of names')
+        by_name = {(e.module, e.name): e for e in self.entries}
+        return Assignment(tuple(self.proxy(by_name[(entry.module, n)])
+                                for n in entry.problems),
+                          entry.title, seed=seed)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+
+def _stamp(module):
+    stat = os.stat(importlib.util.find_spec(module).origin)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+if __name__ == '__main__':
+    import sys
+    for entry in Manifest.open(sys.argv[1:] or ['dbprobs']):
+        print(f'{entry.module}:{entry.lineno} {entry.name} {entry.points} '
+              f'{entry.difficulty} {entry.title}')
@@ -1,43 +1,381 @@
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import shutil
 import subprocess
+import tempfile
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy.random as r
 from Cheetah.Template import Template
+import instrument
+from problem import Problem, snapshot
 
 with open('template.cheetah','r') as _:
     tclass = Template.compile(_.read(), baseclass=dict)
 
-def output2latex(assignment, number_students):
+class ProblemView():
+    """
+    The parts of a solved Problem the template renders, for one student.
+
+    Unlike the Problem (whose solver is not picklable, and whose variables
+    are redrawn for the next student) it can be sent to a worker process.
+    """
+
+    def __init__(self, problem):
+        self.title = problem.title
+        self.difficulty = problem.difficulty
+        self.points = problem.points
+        self.statement = problem.statement
+        self.solution = problem.solution
+        self.vspace = problem.vspace
+        self.vspace_unit = problem.vspace_unit
+        self.dct = {k: snapshot(v, portable=True) for k, v in problem.dct.items()}
+        self._statement = problem._statement
+        self._solution = problem._solution
+
+    render_statement = Problem.render_statement
+    render_solution = Problem.render_solution
+
+def chunked(iterable, size):
+    """Lists of `size` consecutive items of `iterable`, the last maybe shorter."""
+    iterable = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterable, size))
+        if not chunk:
+            return
+        yield chunk
+
+def draw(assignment, students, cohort=False, block=1024):
+    """
+    Draws and solves the problems of each student id in `students`, in
+    order.
+
+    Yields ``(student_id, views)`` with one `ProblemView` per problem of
+    the student's subset (see `Assignment.subset_for`). Each student's
+    problems draw from ``assignment.generator(student_id, problem)``, the
+    global numpy.random unless the assignment is seeded. With
+    ``cohort=True`` the inputs of each `block` of students given a problem
+    are drawn together (one NumPy call per variable when unseeded) and
+    batch safe problems are solved for all of them at once. `students` is
+    consumed lazily, so memory is bounded by the block, not the class.
+    """
+    for chunk in chunked(students, block if cohort else 1):
+        yield from _draw_block(assignment, chunk, cohort)
+
+def _draw_block(assignment, students, cohort):
+    students = list(students)
+    if cohort:
+        # position of each student in the cohort of each of its problems
+        members = {}
+        for n in students:
+            for prob in assignment.subset_for(n):
+                members.setdefault(prob, []).append(n)
+        position = {}
+        for prob, ids in members.items():
+            if assignment.seed is None:
+                generator = r
+            else:
+                generator = [assignment.generator(n, prob) for n in ids]
+            with instrument.span('cohort draw', prob.title):
+                prob.rng_cohort(len(ids), generator)
+            with instrument.span('cohort solve', prob.title):
+                prob.solve_cohort(generator)
+            position[prob] = {n: i for i, n in enumerate(ids)}
+    for n in students:
+        subset = assignment.subset_for(n)
+        for prob in subset:
+            if cohort:
+                prob.select(position[prob][n])
+                continue
+            generator = assignment.generator(n, prob)
+            with instrument.span('draw', prob.title, n):
+                for var in prob:
+                    var.rng(generator)
+            with instrument.span('solve', prob.title, n):
+                prob.solve(generator)
+        with instrument.span('view', None, n):
+            views = [ProblemView(prob) for prob in subset]
+        yield n, views
+
+def write_student(assignment_title, student_id, problems):
+    """Renders and writes the assignment and solution of one student."""
+    name_a = f'out/{assignment_title.replace(" ","-").lower()}-id-{student_id}.tex'
+    name_s = f'out/soln-{assignment_title.replace(" ","-").lower()}-id-{student_id}.tex'
+
+    for name, is_soln in ((name_a, False), (name_s, True)):
+        with instrument.span('render', None, student_id):
+            text = tclass(assignment_name=assignment_title,
+                    student_id=student_id,
+                    problems=problems,
+                    is_soln=is_soln).respond()
+        with instrument.span('write', None, student_id):
+            with open(name, 'w') as _:
+                _.write(text)
+
+    return name_a, name_s
+
+def bundle_name(assignment_title, is_soln=False):
+    name = f'{assignment_title.replace(" ","-").lower()}-bundle.tex'
+    return f'out/soln-{name}' if is_soln else f'out/{name}'
+
+def write_bundle(assignment_title, students, is_soln=False):
+    """
+    Renders the assignments (or solutions) of all `students`, a list of
+    ``(student_id, views)``, as one document with the page and section
+    numbers restarting for each student. Returns the file name.
+    """
+    name = bundle_name(assignment_title, is_soln)
+    with open(name, 'w') as _:
+        _.write(tclass(assignment_name=assignment_title,
+                       students=students,
+                       is_soln=is_soln).respond())
+    return name
+
+def output2bundle(assignment, number_students, cohort=False, students=None):
+    """
+    Writes the assignments of all students as one LaTeX document and
+    their solutions as another, each compiled with one pdflatex run by
+    `bundle2pdf`. Returns the two file names.
+    """
+    if students is None:
+        students = range(number_students)
+    drawn = list(draw(assignment, students, cohort))
+    return [write_bundle(assignment.title, drawn, is_soln)
+            for is_soln in (False, True)]
+
+def _write_student(args):
+    return write_student(*args), instrument.recorder.drain()
+
+_worker = None
+
+def _init_worker(assignment=None, cohort=False, record=False):
+    # import the unit tables and render once, so every task finds them warm
+    global _worker
+    import quantity
+    str(tclass(assignment_name='', student_id=0, problems=[], is_soln=False))
+    _worker = assignment, cohort
+    # stages timed here go back to the parent with each result
+    instrument.recorder = instrument.Recorder() if record else instrument.NullRecorder()
+
+def _generate(students):
+    assignment, cohort = _worker
+    return ([write_student(assignment.title, n, views)
+             for n, views in draw(assignment, students, cohort)],
+            instrument.recorder.drain())
+
+def bounded_map(pool, fn, iterable, window):
+    """
+    Like ``pool.map(fn, iterable)`` but with at most `window` tasks in
+    flight: `iterable` is only advanced as results are taken, so a slow
+    consumer holds back the producer instead of queueing the whole input.
+    """
+    pending = deque()
+    for item in iterable:
+        if len(pending) == window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+def iter_output2latex(assignment, number_students, cohort=False, workers=1,
+                      students=None, window=None, chunk=16):
+    """
+    Writes the assignment and solution of each student as LaTeX, yielding
+    ``(name_a, name_s)`` for each student in order as it is written.
+
+    The stages (student ids, drawing and solving, rendering and writing)
+    are chained generators, with at most `window` tasks (``4*workers`` by
+    default) queued for the pool of `workers` processes (all cores if
+    None). Nothing is drawn before the caller asks for it, so memory stays
+    flat however many students there are. A seeded assignment is drawn
+    and solved in the workers too, `chunk` students per task; otherwise
+    this process draws in student order. Either way the output does not
+    depend on `workers`.
+    """
+    if students is None:
+        students = range(number_students)
+    if workers is None:
+        workers = os.cpu_count()
+    if window is None:
+        window = 4*workers
+    if workers == 1:
+        for n, views in draw(assignment, students, cohort):
+            yield write_student(assignment.title, n, views)
+    elif (assignment.seed is not None
+            and 'fork' in multiprocessing.get_all_start_methods()):
+        # forked workers inherit the assignment, solvers need not pickle
+        with ProcessPoolExecutor(workers,
+                                 mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_worker,
+                                 initargs=(assignment, cohort,
+                                           instrument.recorder.enabled)) as pool:
+            for files, records in bounded_map(pool, _generate, chunked(students, chunk), window):
+                instrument.recorder.extend(records)
+                yield from files
+    else:
+        tasks = ((assignment.title, n, views)
+                 for n, views in draw(assignment, students, cohort))
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(None, False,
+                                           instrument.recorder.enabled)) as pool:
+            for names, records in bounded_map(pool, _write_student, tasks, window):
+                instrument.recorder.extend(records)
+                yield names
+
+def output2latex(assignment, number_students, cohort=False, workers=1,
+                 students=None):
+    """
+    Writes the assignment and solution of each student as LaTeX, returns
+    the file names. See `iter_output2latex`, which streams them instead.
+
+    `students` are the ids to write, all of ``range(number_students)`` by
+    default; with a seeded assignment any of them can be regenerated on its
+    own.
+    """
     names = []
-    for n in range(number_students): # number of students
-        name_a = f'out/{assignment.title.replace(" ","-").lower()}-id-{n}.tex'
-        name_s = f'out/soln-{assignment.title.replace(" ","-").lower()}-id-{n}.tex'
-        st_a = ''
-        st_s = ''
-        for prob in assignment.subset:
-            for var in prob:
-                var.rng()
-            prob.solve()
-
-        with open(name_a, 'w') as _:
-            ass = tclass(assignment_name=assignment.title,
-                    student_id=n,
-                    problems=assignment.subset,
-                    is_soln=False)
-            _.write(ass.respond())
-
-        with open(name_s, 'w') as _:
-            soln = tclass(assignment_name=assignment.title,
-                    student_id=n,
-                    problems=assignment.subset,
-                    is_soln=True)
-            _.write(soln.respond())
-
-    names.append(name_a)
-    names.append(name_s)
+    with instrument.span('output2latex'):
+        for name_a, name_s in iter_output2latex(assignment, number_students,
+                                                cohort, workers, students):
+            names.append(name_a)
+            names.append(name_s)
     return names
 
-def latex2pdf(filenames):
-    for file in filenames:
-        subprocess.run(['pdflatex', '-output-directory=out', file])
+CompileResult = namedtuple('CompileResult',
+                           'tex pdf log returncode duration timed_out')
+CompileResult.__doc__ = """
+Outcome of compiling one .tex file: the paths of the produced pdf and
+log (None if not produced), the pdflatex exit status (None on timeout)
+and the wall-clock duration in seconds."""
+
+def compile_latex(tex, output_directory='out', timeout=None,
+                  pdflatex='pdflatex', extra_outputs=()):
+    """
+    Compiles one .tex file in a scratch directory of its own, so that
+    concurrent jobs never share .aux files, then moves the pdf, the log and
+    any `extra_outputs` extensions into `output_directory`.
+    """
+    name = os.path.splitext(os.path.basename(tex))[0]
+    os.makedirs(output_directory, exist_ok=True)
+    scratch = tempfile.mkdtemp(prefix=f'.{name}-', dir=output_directory)
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run([pdflatex,
+                               '-interaction=nonstopmode',
+                               '-halt-on-error',
+                               f'-output-directory={scratch}',
+                               tex],
+                              stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL,
+                              timeout=timeout)
+        returncode, timed_out = proc.returncode, False
+    except subprocess.TimeoutExpired:
+        returncode, timed_out = None, True
+    duration = time.perf_counter() - start
+
+    outputs = {}
+    for ext in ('.pdf', '.log') + tuple(extra_outputs):
+        path = os.path.join(scratch, name + ext)
+        if os.path.exists(path):
+            outputs[ext] = os.path.join(output_directory, name + ext)
+            os.replace(path, outputs[ext])
+    shutil.rmtree(scratch, ignore_errors=True)
+    return CompileResult(tex, outputs.get('.pdf'), outputs.get('.log'),
+                         returncode, duration, timed_out)
 
-def output2pdf(assignment, number_students):
-    filenames = output2latex(assignment, number_students)
-    latex2pdf(filenames)
+def student_of(tex):
+    """The student id in a per-student file name, None for other files."""
+    match = re.search(r'-id-(\d+)\.tex$', tex)
+    return int(match.group(1)) if match else None
+
+def latex2pdf(filenames, jobs=None, timeout=None, output_directory='out',
+              pdflatex='pdflatex'):
+    """
+    Compiles .tex files with up to `jobs` pdflatex processes at once (all
+    cores if None), each limited to `timeout` seconds. Returns a
+    `CompileResult` per file, in the order of `filenames`.
+    """
+    if shutil.which(pdflatex) is None:
+        raise FileNotFoundError(f'{pdflatex} not found')
+    if jobs is None:
+        jobs = os.cpu_count()
+    with instrument.span('latex2pdf'), ThreadPoolExecutor(jobs) as pool:
+        results = list(pool.map(lambda tex: compile_latex(tex, output_directory,
+                                                          timeout, pdflatex),
+                                filenames))
+    for result in results:
+        instrument.recorder.add('pdflatex', result.duration, None,
+                                student_of(result.tex))
+    return results
+
+def output2pdf(assignment, number_students, workers=1, jobs=None, timeout=None):
+    filenames = output2latex(assignment, number_students, workers=workers)
+    return latex2pdf(filenames, jobs=jobs, timeout=timeout)
+
+def read_page_index(path):
+    """
+    Reads the ``.pages`` file a bundle writes while compiling into a dict
+    of student id to the (first, last) page of the student, 1-based and
+    inclusive.
+    """
+    starts = []
+    with open(path) as _:
+        for line in _:
+            key, page = line.split()
+            # the last student ends where the document does
+            starts.append((key, int(page) + 1 if key == 'end' else int(page)))
+    return {int(student_id): (first, following - 1)
+            for (student_id, first), (_, following) in zip(starts, starts[1:])}
+
+def bundle2pdf(filenames, jobs=None, timeout=None, output_directory='out',
+               pdflatex='pdflatex'):
+    """
+    Compiles bundles like `latex2pdf` and writes each one's page index
+    next to its pdf as ``<name>.json``, mapping student id to the first and
+    last page. Returns the `CompileResult` and the index path (None if
+    the compile failed) of each bundle.
+    """
+    if shutil.which(pdflatex) is None:
+        raise FileNotFoundError(f'{pdflatex} not found')
+    if jobs is None:
+        jobs = os.cpu_count()
+    with ThreadPoolExecutor(jobs) as pool:
+        results = list(pool.map(lambda tex: compile_latex(tex, output_directory,
+                                                          timeout, pdflatex,
+                                                          extra_outputs=('.pages',)),
+                                filenames))
+    indexed = []
+    for result in results:
+        instrument.recorder.add('pdflatex', result.duration)
+        name = os.path.splitext(os.path.basename(result.tex))[0]
+        pages = os.path.join(output_directory, name + '.pages')
+        index = None
+        if result.pdf is not None and os.path.exists(pages):
+            index = os.path.join(output_directory, name + '.json')
+            with open(index, 'w') as _:
+                json.dump({str(k): v for k, v in read_page_index(pages).items()}, _)
+        indexed.append((result, index))
+    return indexed
+
+def split_bundle(pdf, index, output_directory='out', qpdf='qpdf'):
+    """
+    Splits a compiled bundle into one pdf per student with qpdf, using the
+    page index `bundle2pdf` wrote. The files are named like the ones
+    `latex2pdf` makes per student; returns their paths.
+    """
+    if shutil.which(qpdf) is None:
+        raise FileNotFoundError(f'{qpdf} not found')
+    with open(index) as _:
+        pages = json.load(_)
+    prefix = os.path.splitext(os.path.basename(pdf))[0][:-len('-bundle')]
+    names = []
+    for student_id, (first, last) in pages.items():
+        name = os.path.join(output_directory, f'{prefix}-id-{student_id}.pdf')
+        subprocess.run([qpdf, '--empty', '--pages', pdf, f'{first}-{last}',
+                        '--', name], check=True)
+        names.append(name)
+    return names
@@ -1,6 +1,12 @@
+import copy
+from collections import namedtuple
+from contextlib import contextmanager
+import itertools
+import string
+from functools import lru_cache
 import numpy as np
 import numpy.random as r
-from utils import prec_round
+from utils import compositions, prec_round, sample_subset, stable_key, stream, subset_counts, texfmt
 
 class Assignment():
     """
@@ -8,28 +14,123 @@ class Assignment():
     Assignment class randomly selects problems, then can randomly
     generate from those selected problems
 
+    With a `seed`, every (assignment, student, problem) draws from its own
+    generator stream (see `generator`), so any student can be regenerated
+    on its own and independently of how students are split across workers.
+    Without one, everything draws from the global numpy.random state.
+
+    Every student renders the shared `subset` drawn by `rng`, unless `plan`
+    has given each student a subset of their own.
+
     """
 
     def __init__(self 
             , problems
             , title
+            , seed=None
            #,... other metadata 
             ):
         self.problems = problems # problems is all possible problems
         self.title = title
-
-    def rng(self,num_problems,min_difficulty=0,max_difficulty=100000): 
-
-        self.subset = r.choice(self.problems, 
-                num_problems, 
-                replace = False) 
-        while ( sum(x.points for x in self.subset) > max_difficulty |\
-                sum(x.points for x in self.subset) < min_difficulty ):
-            self.subset = r.choice(self.problems, 
-                    num_problems,
-                    replace = False)
+        self.seed = seed
+        self.subsets = None
+
+    def generator(self, student=None, problem=None):
+        """
+        The generator stream of a student's problem, or of the problem
+        subset selection if no student is given.
+        """
+        if self.seed is None:
+            return r
+        if student is None:
+            return stream(self.seed, stable_key(self.title), 0)
+        return stream(self.seed, stable_key(self.title), 1, student,
+                      stable_key(problem.title))
+
+    def rng(self,num_problems,min_difficulty=0,max_difficulty=100000,generator=None): 
+        """
+        Selects `num_problems` problems worth between `min_difficulty` and
+        `max_difficulty` points in total, uniformly over all such subsets.
+        Raises ValueError if no subset fits.
+        """
+        if generator is None:
+            generator = self.generator()
+        chosen = sample_subset([x.points for x in self.problems],
+                num_problems,
+                min_difficulty,
+                max_difficulty,
+                generator)
+        self.subset = [self.problems[i] for i in chosen]
         return None
 
+    def plan(self, number_students, num_problems, min_difficulty=0,
+             max_difficulty=100000, max_shared=1, generator=None):
+        """
+        Gives each of `number_students` students their own subset of
+        `num_problems` problems, stored in `subsets`.
+
+        Every subset has the same point total, the one in the window with
+        the most subsets. Students are planned one after another: each
+        takes the least used problems among the ways to make the total out
+        of the point classes of the bank (ties broken at random), skipping
+        subsets already given to `max_shared` students, so problem usage
+        stays even across the class. Raises ValueError if there are too
+        few subsets for the class.
+
+        Returns the number of students given each problem, by title.
+        """
+        if generator is None:
+            generator = self.generator()
+        points = [x.points for x in self.problems]
+        if any(p != int(p) or p < 0 for p in points):
+            raise ValueError('points must be non-negative integers')
+        low = max(int(np.ceil(min_difficulty)), 0)
+        high = int(np.floor(max_difficulty))
+        counts = subset_counts([int(p) for p in points], num_problems, high)[0][num_problems]
+        if high < low or not any(counts[low:]):
+            raise ValueError(f'no subset of {num_problems} totals in [{low}, {high}]')
+        total = low + int(np.argmax(counts[low:]))
+        if counts[total]*max_shared < number_students:
+            raise ValueError(f'only {counts[total]} subsets total {total} points, '
+                             f'too few for {number_students} students sharing '
+                             f'at most {max_shared}')
+
+        classes = {}
+        for x in self.problems:
+            classes.setdefault(int(x.points), []).append(x)
+        ways = list(compositions({p: len(v) for p, v in classes.items()},
+                                 num_problems, total))
+        usage = {x: 0 for x in self.problems}
+        shared = {}
+        self.subsets = []
+        for n in range(number_students):
+            tiebreak = dict(zip(self.problems, generator.permutation(len(self.problems))))
+            ordered = {p: sorted(v, key=lambda x: (usage[x], tiebreak[x]))
+                       for p, v in classes.items()}
+            score = [sum(usage[x] for p, c in way.items() for x in ordered[p][:c])
+                     for way in ways]
+            shuffle = generator.permutation(len(ways))
+            order = sorted(range(len(ways)), key=lambda i: (score[i], shuffle[i]))
+            # at most one candidate per subset already full, so this ends
+            # within number_students + 1 candidates
+            candidates = (frozenset(itertools.chain(*parts))
+                          for i in order
+                          for parts in itertools.product(
+                              *(itertools.combinations(ordered[p], c)
+                                for p, c in ways[i].items())))
+            subset = next(s for s in candidates if shared.get(s, 0) < max_shared)
+            shared[subset] = shared.get(subset, 0) + 1
+            for x in subset:
+                usage[x] += 1
+            self.subsets.append([x for x in self.problems if x in subset])
+        return {x.title: usage[x] for x in self.problems}
+
+    def subset_for(self, student):
+        """The problems of `student`, its planned subset if there is one."""
+        if self.subsets is None:
+            return self.subset
+        return self.subsets[student]
+
     def __iter__(self):
         for p in self.problems:
             yield p
@@ -39,6 +140,43 @@ class Assignment():
 
 
 
+AUTOFMT = '_autofmt'
+
+class FormatPlan():
+    """
+    A statement or solution string parsed once for the fields it uses.
+
+    `fields` are the variables formatted as they are and `autofmt` the
+    variables formatted with `texfmt` (the ``<name>_autofmt`` fields), so
+    rendering only computes what the text mentions.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.fields = set()
+        self.autofmt = set()
+        for _, field, _, _ in string.Formatter().parse(text):
+            if field is None:
+                continue
+            name = field.split('.', 1)[0].split('[', 1)[0]
+            if name.endswith(AUTOFMT):
+                self.autofmt.add(name[:-len(AUTOFMT)])
+            else:
+                self.fields.add(name)
+        self.fields = frozenset(self.fields)
+        self.autofmt = frozenset(self.autofmt)
+
+    def render(self, dct):
+        mapping = {k: dct[k] for k in self.fields}
+        for k in self.autofmt:
+            mapping[k + AUTOFMT] = texfmt(dct[k].value)
+        return self.text.format_map(mapping)
+
+@lru_cache(maxsize=None)
+def format_plan(text):
+    """The `FormatPlan` of `text`, shared by every problem using it."""
+    return FormatPlan(text)
+
 class Problem(): 
     """ Class attributes:
     title: Problem title
@@ -54,8 +192,16 @@ class Problem():
     solver: Provides only the solution variables that the problem statement asks for directly.
     difficulty: Difficulty on a numerical scale (could be easily changed to have star ratings)
     references: Dictionary of references with key as defined in text format and value as the bibtex reference
+    batch: Whether the solver is batch safe, i.e. gives each student's result when called with
+    the inputs of many students stacked along a leading axis (plain NumPy arithmetic usually is).
+    cacheable: Whether the solver depends on its input values only, so that it can be memoized
+    (a solver that redraws its inputs cannot). Only cacheable problems use a cache.
+    cache: A solvercache.SolverCache memoizing the solver on its input values, or None. Setting
+    Problem.cache applies one to every cacheable problem without its own.
     """
 
+    cache = None
+
     def __init__(
             self,
             title,
@@ -68,7 +214,10 @@ class Problem():
             solution,
             references=None,
             vspace=6,
-            vspace_unit='cm'):
+            vspace_unit='cm',
+            batch=False,
+            cacheable=False,
+            cache=None):
 
         self.title = title
         self.statement = statement
@@ -82,15 +231,49 @@ class Problem():
         self.references = references
         self.vspace = vspace
         self.vspace_unit = vspace_unit
+        self.batch = batch
+        self.cacheable = cacheable
+        if cache is not None:
+            if not cacheable:
+                raise ValueError(f'{title!r} is not cacheable, it cannot have a cache')
+            self.cache = cache
 
         self.dof = len(self.inputs)
 
-    def solve(self):
+    @property
+    def statement(self):
+        return self._statement.text
+
+    @statement.setter
+    def statement(self, text):
+        self._statement = format_plan(text)
+
+    @property
+    def solution(self):
+        return self._solution.text
+
+    @solution.setter
+    def solution(self, text):
+        self._solution = format_plan(text)
+
+    def render_statement(self):
+        return self._statement.render(self.dct)
+
+    def render_solution(self):
+        return self._solution.render(self.dct)
+
+    def call_solver(self, inputs):
+        if self.cache is None or not self.cacheable:
+            return self.solver(**inputs)
+        return self.cache.solve(self, inputs)
+
+    def solve(self, generator=None):
         self.dct = {v.name:v for v in self.inputs}
-        soln = self.solver(**self.dct)
+        with binding(self.inputs, generator):
+            soln = self.call_solver(self.dct)
         
         for y in soln:
-            y.rng()
+            y.rng(generator)
             self.dct[y.name] = y
 
         # now add extraneous inputs
@@ -98,49 +281,260 @@ class Problem():
                 **{v.name:v for v in self.extraneous_inputs}}
         return None
 
+    def rng_cohort(self, number_students, generator=None):
+        """
+        Draws the inputs of a cohort of students, kept as per-student
+        snapshots for `solve_cohort`.
+
+        With a single generator each input is drawn for all students with
+        one call (see ``RandomVariable.rng_cohort``). With a list of
+        per-student generators every student draws from its own stream,
+        exactly as `solve` would.
+        """
+        self.cohort_inputs = []
+        if type(generator) is list:
+            for g in generator:
+                for v in self.inputs:
+                    v.rng(g)
+                self.cohort_inputs.append({v.name:snapshot(v) for v in self.inputs})
+            return None
+
+        for v in self.inputs:
+            v.rng_cohort(number_students, generator)
+        for n in range(number_students):
+            for v in self.inputs:
+                v.select(n)
+            self.cohort_inputs.append({v.name:snapshot(v) for v in self.inputs})
+        return None
+
+    def solve_cohort(self, generator=None):
+        """
+        Solves for every student of a cohort drawn with `rng_cohort`.
+
+        A batch safe solver is called once per group of students whose
+        inputs have the same shapes and units, with the inputs stacked along
+        a leading student axis, and its outputs are split back per student.
+        Other solvers are called student by student. Outputs are randomized
+        with the student's generator if `generator` is a per-student list.
+        The per-student dictionaries are kept in ``self.cohort``, see
+        `select`.
+        """
+        inputs = self.cohort_inputs
+        number_students = len(inputs)
+        if type(generator) is not list:
+            generator = [generator]*number_students
+        extraneous = {v.name:v for v in self.extraneous_inputs}
+        self.cohort = [None]*number_students
+
+        if not self.batch:
+            for n in range(number_students):
+                with binding(inputs[n].values(), generator[n]):
+                    soln = self.call_solver(inputs[n])
+                self.cohort[n] = dict(inputs[n])
+                for y in soln:
+                    y.rng(generator[n])
+                    self.cohort[n][y.name] = snapshot(y)
+                self.cohort[n].update({k: snapshot(v) for k, v in extraneous.items()})
+            return None
+
+        groups = {}
+        for n in range(number_students):
+            key = tuple(signature(v.value) for v in inputs[n].values())
+            groups.setdefault(key, []).append(n)
+
+        for students in groups.values():
+            dct = {}
+            for k, v in inputs[students[0]].items():
+                dct[k] = snapshot(v)
+                dct[k].value = stack([inputs[n][k].value for n in students])
+            soln = self.solver(**dct)
+
+            for y in soln:
+                if np.shape(y.value)[:1] != (len(students),):
+                    raise ValueError(f'solver of {self.title!r} is not batch safe, '
+                                     f'output {y.name!r} is not stacked per student')
+            for i, n in enumerate(students):
+                self.cohort[n] = dict(inputs[n])
+                for y in soln:
+                    y_n = unstack(y, i)
+                    y_n.rng(generator[n])
+                    self.cohort[n][y.name] = y_n
+                self.cohort[n].update({k: snapshot(v) for k, v in extraneous.items()})
+        return None
+
+    def select(self, student):
+        """Makes ``dct`` the solved dictionary of a student of the cohort."""
+        self.dct = self.cohort[student]
+
     def __iter__(self):
         for v in self.inputs:
             yield v
 
 from unit import dim, idim
-from unitparse import eval_units
+from unitparse import eval_units, FrozenUnits
 from quantity import Quantity, eval_dimension, eval_conversion_factor
 
+def bind(var, generator):
+    """
+    The generator `var` draws from: `generator` if given, otherwise the one
+    bound to it by `binding`, otherwise the global numpy.random.
+    """
+    if generator is None:
+        return getattr(var, 'generator', r)
+    return generator
+
+_unbound = object()
+
+@contextmanager
+def binding(variables, generator):
+    """
+    Binds `generator` to `variables` while the enclosed block runs, so a
+    solver that redraws an input with ``x.rng()`` stays on the student's
+    stream. The previous bindings are restored afterwards, so nothing
+    leaks into later (e.g. unseeded) draws of the shared variables.
+    """
+    if generator is None:
+        yield
+        return
+    variables = list(variables)
+    previous = [var.__dict__.get('generator', _unbound) for var in variables]
+    for var in variables:
+        var.generator = generator
+    try:
+        yield
+    finally:
+        for var, g in zip(variables, previous):
+            if g is _unbound:
+                var.__dict__.pop('generator', None)
+            else:
+                var.generator = g
+
+def snapshot(var, portable=False):
+    """
+    Copy of a variable holding its current value, size and unit, without
+    the cohort draws. A `portable` snapshot also drops the generator, so it
+    can be pickled.
+    """
+    drop = ('cohort', 'cohort_factors') + (('generator',) if portable else ())
+    s = copy.copy(var)
+    parts = [s]
+    for attr in ('size', 'unit'):
+        if hasattr(var, attr):
+            setattr(s, attr, copy.copy(getattr(var, attr)))
+            parts.append(getattr(s, attr))
+    for part in parts:
+        for attr in drop:
+            part.__dict__.pop(attr, None)
+    return s
+
+def signature(value):
+    """Shape and units of a value, students with equal ones can be stacked."""
+    return np.shape(value), getattr(value, 'units', None)
+
+def stack(values):
+    """Stacks per-student values along a leading student axis."""
+    if hasattr(values[0], 'units'):
+        return Quantity(np.stack([np.asarray(x) for x in values]), values[0].units)
+    return np.stack(values)
+
+def unstack(var, i):
+    """Copy of a variable with the value of the i-th stacked student."""
+    s = snapshot(var)
+    value = np.asarray(var.value)[i]
+    if value.ndim == 0:
+        value = value.reshape(1)
+    if hasattr(var.value, 'units'):
+        value = Quantity(value, var.value.units)
+    s.value = value
+    if hasattr(var, 'size'):
+        s.size = ConstantSize(len(value))
+    return s
+
+def shape_of(size):
+    """Array shape for a size value, which is an int or a tuple."""
+    return size if type(size) is tuple else (size,)
+
 class RandomSize():
     def __init__(self,
             size):
         self.size = size
 
-    def rng(self):
+    def rng(self, generator=None):
+        generator = bind(self, generator)
         value = self.size
         if type(self.size) is tuple:
             if type(self.size[0]) is tuple:
                 #value = tuple(r.choice(x for x in self.size))
                 x = []
                 for tup in self.size:
-                    x.append( r.choice(tup) )
+                    x.append( generator.choice(tup) )
                 value = tuple(x)
         self.value = value
 
+    def rng_cohort(self, number_students, generator=None):
+        """Draws the sizes of a cohort, returns them as a list."""
+        generator = bind(self, generator)
+        if type(self.size) is tuple and type(self.size[0]) is tuple:
+            x = [generator.choice(tup, size=number_students).tolist() for tup in self.size]
+            self.cohort = list(zip(*x))
+        else:
+            self.cohort = [self.size]*number_students
+        return self.cohort
+
+    def select(self, student):
+        self.value = self.cohort[student]
+
 class ConstantSize():
     def __init__(self,
             size):
         self.size = size
         self.value = self.size
 
-    def rng(self):
+    def rng(self, generator=None):
+        return None
+
+    def rng_cohort(self, number_students, generator=None):
+        return [self.value]*number_students
+
+    def select(self, student):
         return None
 
+def unit_str(value):
+    """LaTeX of a unit dict."""
+    l = []
+    for k, v in value.items():
+        if abs(v) > 0:
+            if v == 1:
+                l.append(f'{{\\rm {k}}}')
+            else:
+                l.append(f'{{\\rm {k}}}^{{{v}}}')
+    return '\\cdot'.join(l)
+
+UnitTable = namedtuple('UnitTable', 'units factors strings')
+UnitTable.__doc__ = """
+A unit set with, for each unit, the factor converting a value from the
+first unit to it and its LaTeX string."""
+
+@lru_cache(maxsize=None)
+def unit_table(units):
+    """The `UnitTable` of a tuple of unit dicts, computed once per set."""
+    base = eval_conversion_factor(units[0])
+    factors = np.array([base/eval_conversion_factor(x) for x in units])
+    factors.flags.writeable = False
+    return UnitTable(units, factors, tuple(unit_str(x) for x in units))
+
+@lru_cache(maxsize=None)
+def units_like(unit):
+    """
+    The units of the registry with the dimension of `unit` (a string),
+    `unit` first.
+    """
+    d = tuple(int(x) for x in eval_dimension(eval_units(unit)))
+    return tuple(sorted(idim[d], key = lambda x: 0 if x == unit else 1))
+
 class Unit():
     def __str__(self):
-        l = []
-        for k, v in self.value.items():
-            if abs(v) > 0:
-                if v == 1:
-                    l.append(f'{{\\rm {k}}}')
-                else:
-                    l.append(f'{{\\rm {k}}}^{{{v}}}')
-        return '\cdot'.join(l)
+        return unit_str(self.value)
 
 class ConstantUnit(Unit):
     def __init__(self,
@@ -152,7 +546,14 @@ class ConstantUnit(Unit):
         self.conversion_factor = 1
         if dimensionality is None:
             self.dimensionality = eval_dimension(self.value)
-    def rng(self):
+    def rng(self, generator=None):
+        return None
+
+    def rng_cohort(self, number_students, generator=None):
+        """Conversion factors of a cohort, all one for a constant unit."""
+        return np.ones(number_students)
+
+    def select(self, student):
         return None
 
 class RandomUnit(Unit):
@@ -164,7 +565,9 @@ class RandomUnit(Unit):
     """
 
     def __init__(self, unit_set, dimensionality=None): 
-        self.unit_set = [eval_units(x) if type(x) is str else x for x in unit_set]
+        self.unit_set = [eval_units(x) if type(x) is str else FrozenUnits(x) for x in unit_set]
+        # conversion factors and strings of the set, shared by equal sets
+        self.table = unit_table(tuple(self.unit_set))
         self.rng()
         if dimensionality is None:
             self.dimensionality = eval_dimension(self.value)
@@ -172,23 +575,33 @@ class RandomUnit(Unit):
     @classmethod
     def from_unit_dimensionality(cls, unit):
         """Infers dimensionality from unit specified as a string."""
+        return cls(units_like(unit))
 
-        try:
-            d = eval_dimension(eval_units(unit))
-            d = tuple(d)
-            d = dim[d]
-        except KeyError:
-            pass
-        unit_set = idim[d]
-        unit_set = sorted(unit_set, key = lambda x: 0 if x == unit else 1)
-        
-        return cls(unit_set)
-
-    def rng(self):
-        self.value = r.choice(self.unit_set)
-        self.conversion_factor = eval_conversion_factor(self.unit_set[0])/eval_conversion_factor(self.value)
+    def rng(self, generator=None):
+        generator = bind(self, generator)
+        self.index = generator.choice(len(self.unit_set))
+        self.value = self.unit_set[self.index]
+        self.conversion_factor = self.table.factors[self.index]
         # from, to convention
 
+    def rng_cohort(self, number_students, generator=None):
+        """
+        Draws the units of a cohort as indices into the unit set, returns
+        the conversion factor of each student.
+        """
+        generator = bind(self, generator)
+        self.cohort = generator.choice(len(self.unit_set), size=number_students)
+        self.cohort_factors = self.table.factors[self.cohort]
+        return self.cohort_factors
+
+    def select(self, student):
+        self.index = self.cohort[student]
+        self.value = self.unit_set[self.index]
+        self.conversion_factor = self.cohort_factors[student]
+
+    def __str__(self):
+        return self.table.strings[self.index]
+
 class RandomSymbol():
     #greek_lower = 'alpha','beta','gamma','delta',
     #greek_upper = 'Gamma','Delta'
@@ -198,8 +611,17 @@ class RandomSymbol():
         self.name = name
         self.symbolset = symbolset
 
-    def rng(self):
-        self.value = r.choice(self.symbolset)
+    def rng(self, generator=None):
+        generator = bind(self, generator)
+        self.value = generator.choice(self.symbolset)
+
+    def rng_cohort(self, number_students, generator=None):
+        generator = bind(self, generator)
+        self.cohort = generator.choice(len(self.symbolset), size=number_students)
+
+    def select(self, student):
+        self.value = self.symbolset[self.cohort[student]]
+
     def __str__(self):
         return self.value
 
@@ -233,7 +655,13 @@ class ConstantVariable(Variable):
             self.size = ConstantSize(1)
             self.value = np.array((self.value,))
 
-    def rng(self):
+    def rng(self, generator=None):
+        return None
+
+    def rng_cohort(self, number_students, generator=None):
+        return None
+
+    def select(self, student):
         return None
 
 class ConstantQuantity(ConstantVariable):
@@ -248,14 +676,24 @@ class ConstantQuantity(ConstantVariable):
         self.unit = unit
         self.value = Quantity(self.value, self.unit.value)
 
-    def rng(self): 
+    def rng(self, generator=None): 
         # if you put in a random unit, you may still want to randomize the unit
         # this is the only randomization among ConstantX classes
-        self.unit.rng()
+        self.unit.rng(generator)
         value = self.value * self.unit.conversion_factor
         value = prec_round(value, self.precision)
         self.value = Quantity(value, self.unit.value)
 
+    def rng_cohort(self, number_students, generator=None):
+        self.cohort = self.value
+        self.unit.rng_cohort(number_students, generator)
+
+    def select(self, student):
+        self.unit.select(student)
+        value = self.cohort * self.unit.conversion_factor
+        value = prec_round(value, self.precision)
+        self.value = Quantity(value, self.unit.value)
+
 class ConstantInteger(ConstantVariable):
     def __init__(self, name, value):
         super().__init__(name, value)
@@ -298,18 +736,58 @@ class RandomVariable(Variable):
         except TypeError:
             return str(self.value)
 
-    def lin_rng(self):
-        return r.random(size=self.size.value)*(self.ub - self.lb) + self.lb
+    def lin_rng(self, size=None, generator=r):
+        if size is None:
+            size = self.size.value
+        return generator.random(size=size)*(self.ub - self.lb) + self.lb
 
-    def log_rng(self):
-        return np.exp(r.random(size=self.size.value)*(np.log(self.ub) - np.log(self.lb)) + np.log(self.lb))
+    def log_rng(self, size=None, generator=r):
+        if size is None:
+            size = self.size.value
+        return np.exp(generator.random(size=size)*(np.log(self.ub) - np.log(self.lb)) + np.log(self.lb))
 
-    def rng(self):
-        self.size.rng()
+    def rng(self, generator=None):
+        generator = bind(self, generator)
+        self.size.rng(generator)
         if self.log_uniform:
-            self.value = self.log_rng()
+            self.value = self.log_rng(generator=generator)
         else:
-            self.value = self.lin_rng()
+            self.value = self.lin_rng(generator=generator)
+
+    def rng_cohort(self, number_students, generator=None):
+        """
+        Draws the values of a whole cohort of students at once.
+
+        Students are grouped by their (possibly random) size and each group
+        is drawn with a single call. If all sizes agree, ``self.cohort`` is
+        one array of shape (number_students, ...), otherwise a list of
+        per-student arrays. `select` makes one student's value ``.value``.
+        """
+        generator = bind(self, generator)
+        sizes = self.size.rng_cohort(number_students, generator)
+        groups = {}
+        for student, size in enumerate(sizes):
+            groups.setdefault(size, []).append(student)
+
+        draw = self.log_rng if self.log_uniform else self.lin_rng
+        if len(groups) == 1:
+            size, = groups
+            self.cohort = self.transform(draw((number_students,) + shape_of(size), generator))
+        else:
+            self.cohort = [None]*number_students
+            for size, students in groups.items():
+                values = self.transform(draw((len(students),) + shape_of(size), generator))
+                for student, value in zip(students, values):
+                    self.cohort[student] = value
+        return self.cohort
+
+    def transform(self, values):
+        """Post-processing of drawn values, applied to whole cohorts."""
+        return values
+
+    def select(self, student):
+        self.size.select(student)
+        self.value = self.cohort[student]
 
 
 class RandomInteger(RandomVariable):
@@ -322,10 +800,13 @@ class RandomInteger(RandomVariable):
         super().__init__(name, lb, ub, size, log_uniform)
         self.rng()
 
-    def rng(self):
-        super().rng()
+    def rng(self, generator=None):
+        super().rng(generator)
         self.value = np.round(self.value).astype(int)
 
+    def transform(self, values):
+        return np.round(values).astype(int)
+
 class RandomReal(RandomVariable):
     def __init__(self,
             name,
@@ -338,10 +819,13 @@ class RandomReal(RandomVariable):
         self.precision = precision
         self.rng()
 
-    def rng(self):
-        super().rng()
+    def rng(self, generator=None):
+        super().rng(generator)
         self.value = prec_round(self.value, precision=self.precision)
 
+    def transform(self, values):
+        return prec_round(values, precision=self.precision)
+
 class RandomQuantity(RandomVariable):
     """
 
@@ -358,9 +842,27 @@ class RandomQuantity(RandomVariable):
         self.precision = precision
         self.rng()
 
-    def rng(self):
-        super().rng() # note this will set self.value to numpy array, not Quantity
-        self.unit.rng()
+    def rng(self, generator=None):
+        generator = bind(self, generator)
+        super().rng(generator) # note this will set self.value to numpy array, not Quantity
+        self.unit.rng(generator)
         value = self.value * self.unit.conversion_factor
         value = prec_round(value, self.precision)
         self.value = Quantity(value, self.unit.value)
+
+    def rng_cohort(self, number_students, generator=None):
+        generator = bind(self, generator)
+        super().rng_cohort(number_students, generator)
+        factors = self.unit.rng_cohort(number_students, generator)
+        if type(self.cohort) is list:
+            self.cohort = [prec_round(x*f, self.precision)
+                           for x, f in zip(self.cohort, factors)]
+        else:
+            factors = factors.reshape((-1,) + (1,)*(self.cohort.ndim - 1))
+            self.cohort = prec_round(self.cohort*factors, self.precision)
+        return self.cohort
+
+    def select(self, student):
+        super().select(student)
+        self.unit.select(student)
+        self.value = Quantity(self.value, self.unit.value)
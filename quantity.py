@@ -1,11 +1,14 @@
 from numpy import ndarray
 import numpy as np
 import operator
+from collections import namedtuple
+from functools import lru_cache
 from unit import dim as dims, conv, idim, nulldim
 from unitparse import (eval_units as unit_parse, 
                       linadd as d_add, 
                       linsubtract as d_sub, 
-                      linscale as d_scale)
+                      linscale as d_scale,
+                      FrozenUnits)
 from utils import prec_round
 
 class UnknownUnitError(KeyError):
@@ -49,7 +52,6 @@ class DimensionMismatchError(Exception):
         elif len(self.objs) == 1:
             s += ' (unit is ' + '*'.join(f'{k}^{v}' for k, v in self.objs[0].units.items() if abs(v) > 0) 
         elif len(self.objs) == 2:
-            d1, d2 = self.dims
             s += ' (units are {} and {}'.format('*'.join(f'{k}^{v}' for k, v in self.objs[0].units.items() if abs(v) > 0),
                     '*'.join(f'{k}^{v}' for k, v in self.objs[1].units.items() if abs(v) > 0))
 #        else: #all operations are binary
@@ -124,29 +126,22 @@ def fail_for_dimension_mismatch(obj1, obj2=None, error_message=None,
     o2hasdim = hasattr(obj2, 'dimension')
 
     if o1hasdim and not o2hasdim:
-        #print('**', obj1.dimension, (obj1.dimension == nulldim).all(), '**') 
         return None, None
     if o2hasdim and not o1hasdim:
-        #print('**', obj2.dimension, (obj2.dimension == nulldim).all(), '**') 
         return None, None
         
-    if (o1hasdim and o2hasdim) and (obj1.dim != obj2.dim).all(): # don't use None Type
+    # dimensions are interned tuples, compare by identity first
+    if (o1hasdim and o2hasdim) and obj1.dim is not obj2.dim and obj1.dim != obj2.dim:
         dim1 = obj1.dim
         dim2 = obj2.dim
         # Special treatment for "0":
-        # if it is not a Quantity, it has "any dimension".
+        # zero has "any dimension".
         # This allows expressions like 3*mV + 0 to pass (useful in cases where
         # zero is treated as the neutral element, e.g. in the Python sum
         # builtin) or comparisons like 3 * mV == 0 to return False instead of
-        # failing # with a DimensionMismatchError. Note that 3*mV == 0*second
-        # is not allowed, though.
-        if (dim1.sum() == 0 and np.all(obj1 == 0) or
-                (dim2.sum() == 0 and np.all(obj2 == 0))):
-            return dim1, dim2
-
-        # We do another check here, this should allow Brian1 units to pass as
-        # having the same dimensions as a Brian2 unit
-        if (dim1 == dim2).all():
+        # failing # with a DimensionMismatchError. As before the units were
+        # interned, this includes zeros with units, 3*mV + 0*second.
+        if np.all(obj1 == 0) or np.all(obj2 == 0):
             return dim1, dim2
 
         if error_message is None:
@@ -157,12 +152,12 @@ def fail_for_dimension_mismatch(obj1, obj2=None, error_message=None,
             error_message = error_message.format(**error_quantities)
         # If we are comparing an object to a specific unit, we don't want to
         # restate this unit (it is probably mentioned in the text already)
-        if obj2 is None or isinstance(obj2, (Dimension, Unit)):
+        if obj2 is None or isinstance(obj2, Unit):
             print(error_message, '**1**')
-            raise DimensionMismatchError(error_message, dim1)
+            raise DimensionMismatchError(error_message, obj1)
         else:
             print(error_message, '**2**')
-            raise DimensionMismatchError(error_message, dim1, dim2)
+            raise DimensionMismatchError(error_message, obj1, obj2)
     else:
         if o1hasdim and o2hasdim:
             return obj1.dim, obj2.dim
@@ -175,81 +170,325 @@ def fail_for_dimension_mismatch(obj1, obj2=None, error_message=None,
         else:
             return None, None
 
-def eval_dimension(units):
-    dimension = np.zeros(7)
+def _short_str(obj):
+    return str(obj) if isinstance(obj, Quantity) else repr(obj)
+
+def _exponent(v):
+    """Unit exponents may come out of numpy arithmetic as 0-d arrays."""
+    if isinstance(v, (np.ndarray, np.generic)):
+        return v.item()
+    return v
+
+class Unit(FrozenUnits):
+    """
+    Interned unit exponent map, e.g. ``{'kg': 1, 'm': -1}``.
+
+    There is one instance per distinct exponent map, obtained with
+    `Unit.intern`. The dimension and SI conversion factor are computed once
+    on interning, and the dimension is a hashable 7-tuple (kg, m, s, A, K,
+    cd, mol), so dimensions can be compared by identity or as tuples.
+
+    Attributes
+    ----------
+    dim : `tuple`
+        The interned dimension tuple.
+    dimension : `ndarray`
+        The same dimension as a read-only float array.
+    factor : `float`
+        The SI conversion factor.
+    """
+    _interned = {}
+    _dims = {}
+
+    @classmethod
+    def intern(cls, units):
+        """Returns the `Unit` for a unit string, dict or `Unit`."""
+        if type(units) is cls:
+            return units
+        if type(units) is str:
+            units = unit_parse(units)
+        try:
+            return cls._interned[units]
+        except (KeyError, TypeError):
+            pass
+        units = FrozenUnits({k: _exponent(v) for k, v in units.items()})
+        try:
+            return cls._interned[units]
+        except KeyError:
+            pass
+
+        dimension = [0]*7
+        factor = 1
+        try:
+            for k, v in units.items():
+                for i, x in enumerate(dims[k]):
+                    dimension[i] += x*v
+                factor *= conv[k]**v
+        except KeyError as e:
+            raise UnknownUnitError(f'passed unit string {units} has unknown unit: {e}')
+
+        unit = cls(units)
+        unit.dim = cls._dims.setdefault(tuple(dimension), tuple(dimension))
+        unit.dimension = np.array(unit.dim, dtype=float)
+        unit.dimension.flags.writeable = False
+        unit.factor = factor
+        return cls._interned.setdefault(unit, unit)
+
+    def __reduce__(self):
+        return (Unit.intern, (dict(self),))
+
+DIMENSIONLESS = Unit.intern({})
+
+# results of unit arithmetic, keyed on the ids of the interned operands
+_products = {}
+_quotients = {}
+
+def unit_product(a, b):
+    """The `Unit` of a product of quantities in units `a` and `b`."""
+    try:
+        return _products[id(a), id(b)]
+    except KeyError:
+        unit = _products[id(a), id(b)] = Unit.intern(d_add(a, b))
+        return unit
+
+_powers = {}
+
+def unit_power(a, exponent):
+    """The `Unit` of a quantity in units `a` to the (scalar) `exponent`."""
+    exponent = _exponent(exponent)
     try:
-        for k, v in units.items():
-            dimension += np.array(dims[k])*v
-        return dimension
-    except UnknownUnitError as e:
-        raise UnknownUnitError(f'passed unit string {units} has unknown unit: {e}')
+        return _powers[id(a), exponent]
+    except KeyError:
+        unit = _powers[id(a), exponent] = Unit.intern(d_scale(a, exponent))
+        return unit
+
+def unit_quotient(a, b):
+    """The `Unit` of a quotient of quantities in units `a` and `b`."""
+    try:
+        return _quotients[id(a), id(b)]
+    except KeyError:
+        unit = _quotients[id(a), id(b)] = Unit.intern(d_sub(a, b))
+        return unit
+
+ConversionPlan = namedtuple('ConversionPlan', 'factor units')
+ConversionPlan.__doc__ = """
+The factor that takes values in some source units to target units, and the
+interned target `Unit`."""
+
+CONVERSION_CACHE_SIZE = 1024
+
+SI_BASE = ('kg', 'm', 's', 'A', 'K', 'cd', 'mol')
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def _conversion_plan(source, target):
+    if target is None:
+        # SI base units of the dimension, zero exponents kept as before
+        target = Unit.intern(dict(zip(SI_BASE, source.dim)))
+    elif target.dim != source.dim:
+        raise DimensionMismatchError('Cannot convert units, dimensions do '
+                                     'not match', Quantity(1., source))
+    return ConversionPlan(source.factor/target.factor, target)
+
+def conversion_plan(source, target=None):
+    """
+    The `ConversionPlan` from `source` to `target` units (unit strings,
+    dicts or `Unit`), or to the SI base units of `source` if `target` is
+    None.
+
+    Plans are cached on the pair of interned units, least recently used
+    ones evicted beyond `CONVERSION_CACHE_SIZE` (see
+    `conversion_cache_info`).
+
+    Raises
+    ------
+    DimensionMismatchError
+        If the dimensions of `source` and `target` differ.
+    """
+    source = Unit.intern(source)
+    if target is not None:
+        target = Unit.intern(target)
+    return _conversion_plan(source, target)
+
+def conversion_cache_info():
+    """Hits, misses, maxsize and currsize of the `conversion_plan` cache."""
+    return _conversion_plan.cache_info()
+
+def conversion_cache_clear():
+    _conversion_plan.cache_clear()
+
+def convert_values(values, source, target=None, out=None):
+    """
+    Bare `values` in `source` units expressed in `target` units (SI if
+    None), one multiplication for the whole array. `out` may be `values`
+    itself to convert in place.
+    """
+    return np.multiply(values, conversion_plan(source, target).factor, out=out)
+
+def convert_all(quantities, target=None):
+    """
+    Converts each of `quantities` in place to `target` units (SI if None)
+    and returns them. The plan is looked up once per distinct source units.
+    """
+    if target is not None:
+        target = Unit.intern(target)
+    plans = {}
+    for q in quantities:
+        units = q.units
+        try:
+            plan = plans[id(units)]
+        except KeyError:
+            plan = plans[id(units)] = _conversion_plan(units, target)
+        q._apply_plan(plan)
+    return quantities
+
+def eval_dimension(units):
+    return np.array(Unit.intern(units).dim, dtype=float)
 
 def eval_conversion_factor(units):
-    factor = 1
-    for k, v in units.items():
-        factor *= conv[k]**v
-    return factor
+    return Unit.intern(units).factor
 
 
 class Quantity(ndarray):
+    """
+    Float array with units.
+
+    Besides the arithmetic operators, NumPy ufuncs (``np.sqrt``,
+    ``np.exp``, ``np.add.reduce`` behind ``np.sum``, ``np.matmul``, ...)
+    and a few array functions (`HANDLED_FUNCTIONS`) work out the units of
+    their result and check dimensions, see `__array_ufunc__`. Views,
+    slices and copies keep the units of the array they come from.
+    """
+    __slots__ = ('_units',)
+
     def __new__(cls, arr, units, copy=False):
 
         subarr = np.array(arr, dtype=float, copy=copy).view(cls)
+        subarr.units = units
+        return subarr
 
-        if type(units) is str:
-            units = unit_parse(units)
+    @classmethod
+    def _from_trusted(cls, arr, units):
+        """
+        Quantity view of the float array `arr` in the interned `Unit`
+        `units`, for results whose units are known to be valid: no copy,
+        no parsing and no interning.
+        """
+        q = arr.view(cls)
+        q._units = units
+        return q
+
+    def __array_finalize__(self, obj):
+        self._units = getattr(obj, '_units', DIMENSIONLESS)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        """
+        Runs `ufunc` on the bare arrays and gives the result the units it
+        has (None for booleans and the like, which stay bare arrays).
+
+        Operands of additive ufuncs and comparisons are converted to the
+        units of the first Quantity, plain numbers are taken to be in those
+        units already. Transcendental ufuncs take dimensionless operands.
+        With `out` Quantities the result is written into them and they take
+        the units, so nothing is allocated beyond what NumPy does.
+        """
+        units = [getattr(x, 'units', None) if isinstance(x, Quantity) else None
+                 for x in inputs]
+        inputs = [x.view(np.ndarray) if isinstance(x, Quantity) else x for x in inputs]
+        if all(u is None for u in units):
+            # only `out` is a Quantity, plain operands give a dimensionless result
+            if method not in ('__call__', 'reduce', 'accumulate', 'reduceat', 'outer'):
+                return NotImplemented
+            result_units = DIMENSIONLESS
+        elif method == '__call__':
+            handler = UFUNC_UNITS.get(ufunc)
+            if handler is None:
+                if any(u is not None and any(u.dim) for u in units):
+                    return NotImplemented
+                inputs = [_dimensionless(ufunc, x, u) for x, u in zip(inputs, units)]
+                result_units = None
+            else:
+                inputs, result_units = handler(ufunc, inputs, units)
+        elif method in ('reduce', 'accumulate', 'reduceat'):
+            result_units = _reduce_units(ufunc, method, inputs[0], units[0], kwargs)
+            if result_units is NotImplemented:
+                return NotImplemented
+        else:
+            return NotImplemented
 
-        subarr.units = units
+        if out is not None:
+            kwargs['out'] = tuple(o.view(np.ndarray) if isinstance(o, Quantity) else o
+                                  for o in out)
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+
+        if out is not None:
+            for o in out:
+                if isinstance(o, Quantity) and result_units is not None:
+                    o.units = result_units
+            return out[0] if len(out) == 1 else out
+        if result_units is None:
+            return result
+        if isinstance(result, tuple):
+            return tuple(_wrap(r, result_units) for r in result)
+        return _wrap(result, result_units)
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func in HANDLED_FUNCTIONS:
+            return HANDLED_FUNCTIONS[func](*args, **kwargs)
+        return super().__array_function__(func, types, args, kwargs)
+
+    def __reduce__(self):
+        # ndarray pickles only the data, keep the units alongside
+        reconstruct, args, state = super().__reduce__()
+        return reconstruct, args, (state, self.units)
+
+    def __setstate__(self, state):
+        state, units = state
+        super().__setstate__(state)
+        self.units = units
 
-        try:
-            eval_dimension(units)
-        except UnknownUnitError as e:
-            raise UnknownUnitError(f'passed unit string {units} has unknown unit: {e}')
+    @property
+    def units(self):
+        return self._units
 
-        return subarr
+    @units.setter
+    def units(self, units):
+        self._units = Unit.intern(units)
 
     @property
     def dimension(self):
-        return eval_dimension(self.units)
+        return self._units.dimension
 
     @property
     def dim(self):
-        return self.dimension
+        return self._units.dim
 
     @property
     def conversion_factor(self):
-        return eval_conversion_factor(self.units)
+        return self._units.factor
 
     def convert_to_SI(self):
-        self *= self.conversion_factor
-        d = self.dimension
-        self.units = {'kg':d[0],
-                      'm':d[1],
-                      's':d[2],
-                      'A':d[3],
-                      'K':d[4],
-                      'cd':d[5],
-                      'mol':d[6]}
-        return self
+        """Converts in place to the SI base units of the dimension."""
+        return self._apply_plan(conversion_plan(self._units))
 
     def convert_to_unit(self, other_units):
-        if type(other_units) is str:
-            other_units = unit_parse(other_units) 
-            
-        try:
-            assert (eval_dimension(other_units) == self.dimension).all()
-        except AssertionError:
-            raise DimensionMismatchError
-
-        self *= eval_conversion_factor(self.units)/eval_conversion_factor(other_units)
-        self.units = other_units
+        """Converts in place to `other_units` (a unit string, dict or `Unit`)."""
+        return self._apply_plan(conversion_plan(self._units, other_units))
+
+    def _apply_plan(self, plan):
+        if plan.factor != 1:
+            # in place on the bare array: the units change after
+            bare = self.view(np.ndarray)
+            bare *= plan.factor
+        self._units = plan.units
         return self
 
     #### ARITHMETIC #### (this is all copied from brian2)
     def _binary_operation(self, other, operation,
                           unit_operation=lambda a, b: a, fail_for_mismatch=False,
                           operator_str=None, inplace=False):
-        if fail_for_mismatch:
+        # equal units match, the usual case, so skip the check
+        if fail_for_mismatch and not (isinstance(other, Quantity)
+                                      and other._units is self._units):
             if inplace:
                 message = ('Cannot calculate ... %s {value}, units do not '
                            'match') % operator_str
@@ -262,58 +501,58 @@ class Quantity(ndarray):
                                                            value1=self,
                                                            value2=other)
 
-        if hasattr(other, 'units'): 
-            other_units = other.units
+        if isinstance(other, Quantity):
+            other_units = other._units
+            other = other.view(np.ndarray)
+            # a zero of other dimensions passed the check and is added as is
+            if fail_for_mismatch and other_units.dim == self._units.dim:
+                other = _convert(other, other_units, self._units)
         else:
-            other_units = {}
+            other_units = DIMENSIONLESS
 
         if inplace:
-            if self.shape == ():
-                self_value = Quantity(self, copy=True)
-            else:
-                self_value = self
-            operation(self_value, other)
-            self_value.units = unit_operation(self.units, other_units)
-            return self_value
+            # on the bare arrays, the units are set here and not by __array_ufunc__
+            operation(self.view(np.ndarray), other)
+            self._units = unit_operation(self._units, other_units)
+            return self
         else:
-            newunits = unit_operation(self.units, other_units)
-            self_arr = np.array(self, copy=False)
-            other_arr = np.array(other, copy=False)
-            result = operation(self_arr, other_arr)
-            return Quantity(result, newunits)
+            result = operation(self.view(np.ndarray), other)
+            return Quantity._from_trusted(np.asarray(result, dtype=float),
+                                          unit_operation(self._units, other_units))
 
     def __mul__(self, other):
-        return self._binary_operation(other, operator.mul, d_add)
+        return self._binary_operation(other, operator.mul, unit_product)
 
     def __rmul__(self, other):
         return self.__mul__(other)
 
     def __imul__(self, other):
-        return self._binary_operation(other, np.ndarray.__imul__, d_add,
+        return self._binary_operation(other, np.ndarray.__imul__, unit_product,
                                       inplace=True)
 
     def __div__(self, other):
-        return self._binary_operation(other, operator.truediv, d_sub)
+        return self._binary_operation(other, operator.truediv, unit_quotient)
 
     def __truediv__(self, other):
         return self.__div__(other)
 
     def __rdiv__(self, other):
-        # division with swapped arguments
-        rdiv = lambda a, b: operator.truediv(b, a)
-        d_sub = lambda x, b: d_sub(b, a)
-        return self._binary_operation(other, rdiv, d_sub)
+        # division with swapped arguments, other is not a Quantity (or its
+        # __truediv__ would have run)
+        return Quantity._from_trusted(
+            np.asarray(np.true_divide(other, self.view(np.ndarray)), dtype=float),
+            unit_quotient(DIMENSIONLESS, self._units))
 
     def __rtruediv__(self, other):
         return self.__rdiv__(other)
 
     def __idiv__(self, other):
         return self._binary_operation(other, np.ndarray.__itruediv__,
-                                      d_sub, inplace=True)
+                                      unit_quotient, inplace=True)
 
     def __itruediv__(self, other):
         return self._binary_operation(other, np.ndarray.__itruediv__,
-                                      d_sub, inplace=True)
+                                      unit_quotient, inplace=True)
 
     def __mod__(self, other):
         return self._binary_operation(other, operator.mod,
@@ -340,14 +579,12 @@ class Quantity(ndarray):
                                       operator_str='-')
 
     def __rsub__(self, other):
-        # We allow operations with 0 even for dimension mismatches, e.g.
-        # 0 - 3*mV is allowed. In this case, the 0 is not represented by a
-        # Quantity object so we cannot simply call Quantity.__sub__
-        if ((not isinstance(other, Quantity) or other.dim is DIMENSIONLESS) and
-                np.all(other == 0)):
-            return self.__neg__()
-        else:
-            return Quantity(other, copy=False, force_quantity=True).__sub__(self)
+        # other is not a Quantity (or its __sub__ would have run). Like in
+        # __sub__ a plain number is taken in the units of self, which also
+        # allows 0 - 3*mV.
+        return Quantity._from_trusted(
+            np.asarray(np.subtract(other, self.view(np.ndarray)), dtype=float),
+            self._units)
 
     def __isub__(self, other):
         return self._binary_operation(other, np.ndarray.__isub__,
@@ -356,58 +593,225 @@ class Quantity(ndarray):
                                       inplace=True)
     def __pow__(self, other):
         if isinstance(other, np.ndarray) or is_scalar_type(other):
-            fail_for_dimension_mismatch(other,
-                                        error_message='Cannot calculate '
-                                                      '{base} ** {exponent}, '
-                                                      'the exponent has to be '
-                                                      'dimensionless',
-                                        base=self, exponent=other)
-            other = np.array(other, copy=False)
-            return Quantity(np.array(self, copy=False)**other,
-                            d_scale(self.units, other))
+            # the exponent has to be dimensionless and the same for all values
+            return np.power(self, other)
         else:
             return NotImplemented
 
     def __rpow__(self, other):
-        if self.is_dimensionless:
-            if isinstance(other, np.ndarray) or isinstance(other, np.ndarray):
-                new_array = np.array(other, copy=False)**np.array(self,
-                                                                  copy=False)
-                return Quantity(new_array, DIMENSIONLESS)
-            else:
-                return NotImplemented
-        else:
-            raise DimensionMismatchError(('Cannot calculate '
-                                          '{base} ** {exponent}, the '
-                                          'exponent has to be '
-                                          'dimensionless').format(base=_short_str(other),
-                                                                  exponent=_short_str(self)),
-                                         self.dim)
+        # the exponent has to be dimensionless, the result is a bare array
+        return np.power(other, self)
+
     def __ipow__(self, other):
         if isinstance(other, np.ndarray) or is_scalar_type(other):
-            fail_for_dimension_mismatch(other,
-                                        error_message='Cannot calculate '
-                                                      '... **= {exponent}, '
-                                                      'the exponent has to be '
-                                                      'dimensionless',
-                                        exponent=other)
-            other = np.array(other, copy=False)
-            super(Quantity, self).__ipow__(other)
-            self.units = d_scale(self.units, other) 
-            return self
+            return np.power(self, other, out=(self,))
         else:
             return NotImplemented
 
     def __neg__(self):
-        return Quantity(-np.array(self, copy=False), self.units)
+        return Quantity._from_trusted(-self.view(np.ndarray), self._units)
 
     def __pos__(self):
         return self
 
     def __abs__(self):
-        return Quantity(abs(np.array(self, copy=False)), self.units)
+        return Quantity._from_trusted(abs(self.view(np.ndarray)), self._units)
 
     def __str__(self):
         fmted_val = ",".join(f"{x:.2f}" for x in self.tolist())
         fmted_uni = '*'.join(f'{k}^{v}' for k, v in self.units.items() if abs(v) > 0)
         return f'({fmted_val}) {fmted_uni}'
+
+
+#### NUMPY PROTOCOLS ####
+def _wrap(result, units):
+    """A Quantity view of a ufunc result, no copy."""
+    return Quantity._from_trusted(np.asarray(result), units)
+
+def _convert(x, units, target):
+    """Bare values `x` in `units` expressed in `target` units."""
+    if units is None or units is target:
+        return x
+    if units.dim != target.dim:
+        raise DimensionMismatchError('Cannot convert units, dimensions do '
+                                     'not match', Quantity(x, units))
+    factor = _conversion_plan(units, target).factor
+    if factor == 1:
+        return x
+    return x*factor
+
+def _dimensionless(ufunc, x, units):
+    """Bare values of a dimensionless operand, in SI (e.g. km/m scaled)."""
+    if units is None:
+        return x
+    if any(units.dim):
+        raise DimensionMismatchError(f'Cannot calculate {ufunc.__name__}, the '
+                                     'argument has to be dimensionless',
+                                     Quantity(x, units))
+    return _convert(x, units, DIMENSIONLESS)
+
+def _first_units(units):
+    return next((u for u in units if u is not None), DIMENSIONLESS)
+
+def _same_units(ufunc, inputs, units):
+    # all operands in the units of the first Quantity
+    target = _first_units(units)
+    try:
+        inputs = [_convert(x, u, target) for x, u in zip(inputs, units)]
+    except DimensionMismatchError:
+        raise DimensionMismatchError(f'Cannot calculate {ufunc.__name__}, units '
+                                     'do not match', *(Quantity(x, u) for x, u
+                                                       in zip(inputs, units)
+                                                       if u is not None))
+    return inputs, target
+
+def _compare_units(ufunc, inputs, units):
+    inputs, _ = _same_units(ufunc, inputs, units)
+    return inputs, None
+
+def _same_dimensionless(ufunc, inputs, units):
+    # e.g. arctan2, operands of equal dimension and a dimensionless result
+    inputs, _ = _same_units(ufunc, inputs, units)
+    return inputs, DIMENSIONLESS
+
+def _keep_units(ufunc, inputs, units):
+    return inputs, units[0]
+
+def _product_units(ufunc, inputs, units):
+    return inputs, unit_product(units[0] or DIMENSIONLESS, units[1] or DIMENSIONLESS)
+
+def _quotient_units(ufunc, inputs, units):
+    return inputs, unit_quotient(units[0] or DIMENSIONLESS, units[1] or DIMENSIONLESS)
+
+def _scaled_units(exponent):
+    def handler(ufunc, inputs, units):
+        return inputs, unit_power(units[0], exponent)
+    return handler
+
+def _power_units(ufunc, inputs, units):
+    base, exponent = inputs
+    exponent = np.asarray(_dimensionless(ufunc, exponent, units[1]))
+    if units[0] is None:
+        return [base, exponent], None
+    if exponent.size != 1 and np.any(exponent != exponent.flat[0]):
+        raise DimensionMismatchError('Cannot calculate power with different '
+                                     'exponents, the result would not have '
+                                     'one unit', Quantity(base, units[0]))
+    return [base, exponent], unit_power(units[0], exponent.flat[0])
+
+def _transcendental(ufunc, inputs, units):
+    return [_dimensionless(ufunc, x, u) for x, u in zip(inputs, units)], DIMENSIONLESS
+
+def _predicate(ufunc, inputs, units):
+    return inputs, None
+
+UFUNC_UNITS = {}
+for _ufunc in (np.add, np.subtract, np.maximum, np.minimum, np.fmax, np.fmin,
+               np.remainder, np.fmod, np.hypot, np.copysign, np.nextafter):
+    UFUNC_UNITS[_ufunc] = _same_units
+for _ufunc in (np.equal, np.not_equal, np.less, np.less_equal, np.greater,
+               np.greater_equal):
+    UFUNC_UNITS[_ufunc] = _compare_units
+for _ufunc in (np.negative, np.positive, np.absolute, np.fabs, np.rint,
+               np.floor, np.ceil, np.trunc, np.conjugate, np.spacing):
+    UFUNC_UNITS[_ufunc] = _keep_units
+for _ufunc in (np.exp, np.exp2, np.expm1, np.log, np.log2, np.log10, np.log1p,
+               np.sin, np.cos, np.tan, np.arcsin, np.arccos, np.arctan,
+               np.sinh, np.cosh, np.tanh, np.arcsinh, np.arccosh, np.arctanh,
+               np.deg2rad, np.rad2deg):
+    UFUNC_UNITS[_ufunc] = _transcendental
+for _ufunc in (np.isnan, np.isinf, np.isfinite, np.signbit, np.sign):
+    UFUNC_UNITS[_ufunc] = _predicate
+UFUNC_UNITS.update({np.multiply: _product_units,
+                    np.matmul: _product_units,
+                    np.divide: _quotient_units,
+                    np.floor_divide: _quotient_units,
+                    np.arctan2: _same_dimensionless,
+                    np.reciprocal: _scaled_units(-1),
+                    np.sqrt: _scaled_units(0.5),
+                    np.cbrt: _scaled_units(1/3),
+                    np.square: _scaled_units(2),
+                    np.power: _power_units,
+                    np.float_power: _power_units})
+
+def _reduce_units(ufunc, method, x, units, kwargs):
+    """Units of ``ufunc.reduce`` (np.sum, np.prod, ...) and friends."""
+    if ufunc in (np.add, np.maximum, np.minimum, np.fmax, np.fmin):
+        return units
+    if ufunc in (np.logical_and, np.logical_or):
+        return None
+    if ufunc is np.multiply:
+        if units is None or not any(units.values()):
+            return units
+        if method == 'reduce' and kwargs.get('where', True) is True:
+            # the product of n values has the units to the n
+            axis = kwargs.get('axis', 0)
+            shape = np.shape(x)
+            if axis is None:
+                n = int(np.prod(shape))
+            else:
+                axes = axis if isinstance(axis, tuple) else (axis,)
+                n = int(np.prod([shape[a] for a in axes]))
+            return unit_power(units, n)
+        raise DimensionMismatchError(f'Cannot calculate multiply.{method}, the '
+                                     'result would not have one unit',
+                                     Quantity(x, units))
+    return NotImplemented
+
+HANDLED_FUNCTIONS = {}
+
+def implements(func):
+    """Registers a unit-aware version of a NumPy function for Quantity."""
+    def register(f):
+        HANDLED_FUNCTIONS[func] = f
+        return f
+    return register
+
+def _bare(x):
+    return x.view(np.ndarray) if isinstance(x, Quantity) else x
+
+@implements(np.concatenate)
+def _concatenate(arrays, axis=0, out=None, **kwargs):
+    arrays = list(arrays)
+    units = [x.units if isinstance(x, Quantity) else None for x in arrays]
+    arrays, target = _same_units(np.concatenate, [_bare(x) for x in arrays], units)
+    if out is not None:
+        np.concatenate(arrays, axis, out=_bare(out), **kwargs)
+        if isinstance(out, Quantity):
+            out.units = target
+        return out
+    return _wrap(np.concatenate(arrays, axis, **kwargs), target)
+
+@implements(np.dot)
+def _dot(a, b, out=None):
+    inputs, units = _product_units(np.dot, [_bare(a), _bare(b)],
+                                   [getattr(a, 'units', None), getattr(b, 'units', None)])
+    if out is not None:
+        np.dot(*inputs, out=_bare(out))
+        if isinstance(out, Quantity):
+            out.units = units
+        return out
+    return _wrap(np.dot(*inputs), units)
+
+@implements(np.where)
+def _where(condition, *xy):
+    if not xy:
+        return np.where(_bare(condition))
+    units = [getattr(x, 'units', None) for x in xy]
+    xy, target = _same_units(np.where, [_bare(x) for x in xy], units)
+    return _wrap(np.where(_bare(condition), *xy), target)
+
+@implements(np.clip)
+def _clip(a, a_min, a_max, out=None, **kwargs):
+    units = [getattr(x, 'units', None) for x in (a, a_min, a_max)]
+    inputs, target = _same_units(np.clip, [_bare(x) for x in (a, a_min, a_max)], units)
+    if out is not None:
+        np.clip(*inputs, out=_bare(out), **kwargs)
+        if isinstance(out, Quantity):
+            out.units = target
+        return out
+    return _wrap(np.clip(*inputs, **kwargs), target)
+
+@implements(np.linalg.norm)
+def _norm(x, *args, **kwargs):
+    return _wrap(np.linalg.norm(_bare(x), *args, **kwargs), x.units)
@@ -0,0 +1,160 @@
+"""
+Memoization of Problem solvers on their input values.
+
+Inputs drawn from small discrete ranges repeat across a class, and a
+solver only depends on its inputs, so its outputs can be reused. A
+`SolverCache` is opt in, for problems declared ``cacheable=True``, per
+problem (``Problem(..., cacheable=True, cache=SolverCache())``) or for all
+of them (``Problem.cache = SolverCache()``). It is keyed on a blake2b
+digest of the problem title, the solver (module, qualified name and a
+digest of its code) and the name, class, value (dtype, shape and bytes)
+and units of every input, evicts least recently used results beyond
+`maxsize` and can be saved to and loaded from disk. Saved results of
+another `FORMAT` are not loaded.
+
+Solvers that draw random numbers themselves must not be memoized, their
+problems are not cacheable.
+"""
+import copy
+import hashlib
+import os
+import pickle
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from types import CodeType
+
+import numpy as np
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses evictions currsize maxsize')
+
+# of the keys and of the saved file, change it when either changes
+FORMAT = 2
+
+
+def _update(h, value):
+    units = getattr(value, 'units', None)
+    a = np.asarray(value)
+    if a.dtype.hasobject:
+        h.update(repr(value).encode())
+    else:
+        h.update(f'{a.dtype.str}{a.shape}'.encode())
+        h.update(np.ascontiguousarray(a).tobytes())
+    if units is not None:
+        h.update(repr(sorted(units.items())).encode())
+
+
+def _update_code(h, code):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _update_code(h, const)
+        elif isinstance(const, frozenset):
+            # set order depends on string hashing, which changes between runs
+            h.update(repr(sorted(map(repr, const))).encode())
+        else:
+            h.update(repr(const).encode())
+
+
+@lru_cache(maxsize=None)
+def _code_digest(code):
+    h = hashlib.blake2b(digest_size=16)
+    _update_code(h, code)
+    return h.digest()
+
+
+def solver_key(title, solver, inputs):
+    """
+    Digest of the problem `title`, its `solver` and the `inputs` the solver
+    is called with.
+    """
+    h = hashlib.blake2b(title.encode(), digest_size=16)
+    h.update(f'\0{solver.__module__}\0{solver.__qualname__}\0'.encode())
+    h.update(_code_digest(solver.__code__))
+    for name in sorted(inputs):
+        var = inputs[name]
+        h.update(f'\0{name}\0{type(var).__name__}\0'.encode())
+        _update(h, var.value)
+        unit = getattr(var, 'unit', None)
+        if unit is not None:
+            _update(h, getattr(unit, 'value', None))
+    return h.digest()
+
+
+class SolverCache():
+    """
+    Size bounded memo of solver outputs.
+
+    `path` is where `save` writes and where the cache is loaded from when it
+    is created, if the file exists.
+    """
+
+    def __init__(self, maxsize=4096, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self._results = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def solve(self, problem, inputs):
+        """
+        The outputs of ``problem.solver(**inputs)``, from the cache if the
+        same problem was solved for the same inputs before. The outputs are
+        copies, callers may randomize them.
+        """
+        from problem import snapshot
+        key = solver_key(problem.title, problem.solver, inputs)
+        try:
+            soln = self._results[key]
+        except KeyError:
+            self.misses += 1
+            soln = tuple(snapshot(y, portable=True)
+                         for y in problem.solver(**inputs))
+            self._results[key] = soln
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self._results.move_to_end(key)
+        return copy.deepcopy(soln)
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions,
+                         len(self._results), self.maxsize)
+
+    @property
+    def hit_rate(self):
+        calls = self.hits + self.misses
+        return self.hits/calls if calls else 0.
+
+    def clear(self):
+        self._results.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def save(self, path=None):
+        """Pickles the results to `path` (the cache's own by default)."""
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as _:
+            pickle.dump({'format': FORMAT, 'results': list(self._results.items())}, _)
+        os.replace(tmp, path)
+
+    def load(self, path=None):
+        """
+        Adds the results pickled at `path`, keeping at most `maxsize`.
+        Results saved in another format are ignored.
+        """
+        with open(path or self.path, 'rb') as _:
+            saved = pickle.load(_)
+        if not isinstance(saved, dict) or saved.get('format') != FORMAT:
+            return
+        for key, soln in saved['results']:
+            self._results[key] = soln
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def __len__(self):
+        return len(self._results)
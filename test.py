@@ -17,6 +17,72 @@ def test_all_assignments(): # this is only the assignment class, not the problem
     for ass in assignments:
         ass.rng(len(ass)) # can be a number less than the number of problems
 
+def test_sample_subset():
+    import numpy as np
+    from utils import sample_subset
+    points = [2, 2, 4, 6, 1, 3]
+    g = np.random.default_rng(0)
+    seen = {}
+    for _ in range(3000):
+        chosen = sample_subset(points, 3, 7, 8, g)
+        assert len(set(chosen)) == 3 and 7 <= sum(points[i] for i in chosen) <= 8
+        key = tuple(sorted(chosen))
+        seen[key] = seen.get(key, 0) + 1
+    # every fitting subset is drawn, about equally often
+    assert len(seen) == 5
+    assert max(seen.values()) < 1.3*min(seen.values())
+    for k, low, high in ((3, 20, 30), (7, 0, 100), (2, 5, 4)):
+        try:
+            sample_subset(points, k, low, high, g)
+        except ValueError:
+            pass
+        else:
+            assert False
+    ass = Assignment(dbprobs.A01.problems, 'Bounded', seed=1)
+    ass.rng(3, min_difficulty=5, max_difficulty=7)
+    assert sum(x.points for x in ass.subset) == 6
+
+def test_plan():
+    bank = sum((ass.problems for ass in assignments), ())
+    ass = Assignment(bank, 'Planned', seed=4)
+    usage = ass.plan(12, 3)
+    assert len(ass.subsets) == 12
+    assert len({frozenset(s) for s in ass.subsets}) == 12
+    assert len({sum(x.points for x in s) for s in ass.subsets}) == 1
+    assert sum(usage.values()) == 12*3
+    used = [v for v in usage.values() if v]
+    assert max(used) - min(used) <= 2
+    names = output2latex(ass, 12, cohort=True)
+    for n, s in enumerate(ass.subsets):
+        text = open(names[2*n]).read()
+        assert all(x.title in text for x in s)
+    try:
+        ass.plan(5, 1, max_shared=1, min_difficulty=4, max_difficulty=4)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_manifest():
+    import os, tempfile
+    from manifest import Manifest
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'manifest.json')
+        manifest = Manifest.open(['dbprobs'], path)
+        assert Manifest.open(['dbprobs'], path).entries == manifest.entries
+    found = {(e.title, e.points, e.difficulty) for e in manifest}
+    assert found == {(p.title, p.points, p.difficulty) for p in problems}
+    easy = manifest.problems(max_points=2, difficulty='easy')
+    assert {p.title for p in easy} == {p.title for p in problems
+                                       if p.points <= 2 and p.difficulty == 'easy'}
+    assert not any(p.loaded for p in easy)
+    ass = manifest.assignment('A01', seed=3)
+    ass.rng(2)
+    assert not any(p.loaded for p in ass)
+    output2latex(ass, 2)
+    assert {p.loaded for p in ass} == {True, False}
+    assert all(p.load() is getattr(dbprobs, p.entry.name) for p in ass if p.loaded)
+
 def test_all_problems():
     for prob in problems:
         for var in prob:
@@ -27,6 +93,392 @@ def test_all_output2latex():
     for ass in assignments:
         output2latex(ass, 1)
 
+def test_all_output2latex_cohort():
+    for ass in assignments:
+        ass.rng(len(ass))
+        output2latex(ass, 3, cohort=True)
+
+def test_binding():
+    import numpy as np
+    from problem import binding
+    print('scoped generator binding test')
+    x = dbprobs.P01.inputs[0]
+    g = np.random.default_rng(1)
+    with binding([x], g):
+        x.rng()
+        drawn = x.value
+    assert drawn == np.round(np.random.default_rng(1).random(1)*9 + 1).astype(int)
+    assert 'generator' not in x.__dict__
+    np.random.seed(4)
+    x.rng()
+    np.random.seed(4)
+    assert x.value == np.round(np.random.random(1)*9 + 1).astype(int)
+
+def test_solve_cohort():
+    import numpy as np
+    print('batched solve test')
+    for prob in (dbprobs.P01, dbprobs.P04, dbprobs.P07, dbprobs.P10):
+        prob.rng_cohort(40)
+        prob.batch = False
+        np.random.seed(0)
+        prob.solve_cohort()
+        looped = prob.cohort
+        prob.batch = True
+        np.random.seed(0)
+        prob.solve_cohort()
+        for n in (0, 17, 39):
+            prob.select(n)
+            assert prob.dct.keys() == looped[n].keys()
+            for k, v in prob.dct.items():
+                w = looped[n][k]
+                assert np.shape(v.value) == np.shape(w.value)
+                if hasattr(v, 'unit'):
+                    # output units are drawn independently, compare unconverted
+                    assert np.allclose(np.asarray(v.value)/v.unit.conversion_factor,
+                                       np.asarray(w.value)/w.unit.conversion_factor, rtol=1e-2)
+                else:
+                    assert np.allclose(v.value, w.value)
+        print(prob.title, prob.dct)
+
+def test_solver_cache():
+    import os, pickle, tempfile
+    import numpy as np
+    from solvercache import SolverCache, solver_key
+    print('solver cache test')
+    for prob in (dbprobs.P01, dbprobs.P07):
+        prob.cache = SolverCache(maxsize=50)
+        for n in range(200):
+            prob.rng_cohort(1)
+            inputs = prob.cohort_inputs[0]
+            cached = prob.call_solver(inputs)
+            plain = prob.solver(**inputs)
+            for y, z in zip(cached, plain):
+                assert y is not z and np.all(np.asarray(y.value) == np.asarray(z.value))
+        info = prob.cache.info()
+        assert info.hits + info.misses == 200 and info.currsize <= 50
+        assert info.evictions == info.misses - info.currsize
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'solver.pkl')
+            prob.cache.save(path)
+            loaded = SolverCache(maxsize=50, path=path)
+            assert len(loaded) == info.currsize
+            prob.cache = loaded
+            prob.call_solver(inputs)
+            assert loaded.hits == 1
+        del prob.cache
+    # P09's solver redraws its inputs, it is not memoized
+    assert not dbprobs.P09.cacheable
+    dbprobs.P09.cache = SolverCache()
+    dbprobs.P09.rng_cohort(1)
+    dbprobs.P09.call_solver(dbprobs.P09.cohort_inputs[0])
+    assert len(dbprobs.P09.cache) == 0 and dbprobs.P09.cache.info().misses == 0
+    del dbprobs.P09.cache
+    try:
+        Problem('t', '', 'easy', 1, (), (), dbprobs.P09.solver, '', cache=SolverCache())
+    except ValueError:
+        pass
+    else:
+        assert False
+    # same title and inputs, another solver
+    inputs = dbprobs.P01.cohort_inputs[0]
+    assert (solver_key(dbprobs.P01.title, dbprobs.P01.solver, inputs)
+            != solver_key(dbprobs.P01.title, dbprobs.P02.solver, inputs))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'solver.pkl')
+        with open(path, 'wb') as _:
+            pickle.dump([(b'old key', ())], _)
+        assert len(SolverCache(path=path)) == 0
+    # P01's 100 input pairs fit, so most of 200 draws hit
+    dbprobs.P01.cache = SolverCache()
+    for n in range(200):
+        for var in dbprobs.P01:
+            var.rng()
+        dbprobs.P01.solve()
+    assert dbprobs.P01.cache.hit_rate > 0.4
+    del dbprobs.P01.cache
+
+def test_output2latex_parallel():
+    import numpy as np
+    print('parallel output test')
+    for ass in assignments:
+        ass.rng(len(ass))
+        outputs = []
+        for workers in (1, 3):
+            np.random.seed(1)
+            names = output2latex(ass, 7, workers=workers)
+            assert len(names) == 2*7
+            outputs.append([open(name).read() for name in names])
+        assert outputs[0] == outputs[1]
+
+def test_output2latex_seeded():
+    print('seeded output test')
+    for ass in assignments:
+        seeded = Assignment(ass.problems, ass.title, seed=2021)
+        seeded.rng(len(seeded))
+        outputs = []
+        for workers, cohort in ((1, False), (3, False), (1, True)):
+            names = output2latex(seeded, 7, cohort=cohort, workers=workers)
+            outputs.append([open(name).read() for name in names])
+        assert outputs[0] == outputs[1] == outputs[2]
+        # a single student regenerates on its own
+        names = output2latex(seeded, 7, students=[5])
+        assert [open(name).read() for name in names] == outputs[0][10:12]
+        # the shared variables go back to drawing from numpy.random
+        for prob in ass.problems:
+            for var in list(prob.inputs) + list(prob.extraneous_inputs):
+                assert 'generator' not in var.__dict__
+
+def test_iter_output2latex():
+    from outputroutines import iter_output2latex
+    print('streaming output test')
+    ass = Assignment(dbprobs.A01.problems, dbprobs.A01.title, seed=6)
+    ass.rng(len(ass))
+    expected = output2latex(ass, 40)
+    for workers, cohort in ((1, False), (1, True), (2, False)):
+        taken = []
+        def ids():
+            for n in range(10**6):
+                taken.append(n)
+                yield n
+        files = iter_output2latex(ass, None, cohort=cohort, workers=workers,
+                                  students=ids(), window=2, chunk=1)
+        for n in range(40):
+            assert list(next(files)) == expected[2*n:2*n + 2]
+        files.close()
+        # students are only drawn as results are taken
+        assert len(taken) <= (1024 if cohort else 40 + 3)
+
+def test_answer_key():
+    import os, tempfile
+    import numpy as np
+    from answerkey import AnswerKey, export_answers
+    from outputroutines import draw
+    print('answer key test')
+    for ass in (dbprobs.A01, dbprobs.A02):
+        seeded = Assignment(ass.problems, ass.title, seed=4)
+        seeded.plan(12, len(seeded) - 1, max_shared=12)
+        with tempfile.TemporaryDirectory() as tmp:
+            key = AnswerKey(export_answers(seeded, 12, os.path.join(tmp, 'key'),
+                                           cohort=True))
+            assert len(key) == 12 and isinstance(key.students, np.memmap)
+            for n, views in draw(seeded, [0, 7, 11]):
+                answers = key.student(n)
+                assert list(answers) == [v.title for v in views]
+                for v in views:
+                    for name, var in v.dct.items():
+                        value = answers[v.title][name]
+                        assert np.array_equal(value, var.value)
+                        assert getattr(value, 'units', None) == getattr(var.value, 'units', None)
+            title = seeded.problems[0].title
+            assigned = key.assigned(title)
+            assert assigned.tolist() == [seeded.problems[0] in seeded.subset_for(n)
+                                         for n in range(12)]
+            name = next(iter(key.problems[title]['columns']))
+            column = key.column(title, name)
+            if column.ndim <= 1 and np.diff(column.offsets).max() == 1:
+                assert np.isnan(column.scalars()[~assigned]).all()
+    with tempfile.TemporaryDirectory() as tmp:
+        seeded = Assignment(dbprobs.A03.problems, dbprobs.A03.title, seed=4)
+        seeded.rng(1)
+        key = AnswerKey(export_answers(seeded, 20, tmp))
+        x = key.column(dbprobs.P07.title, 'x')
+        assert x.role == 'output'
+        si = x.scalars()
+        assert np.allclose(si, [np.asarray(x[n].convert_to_SI())[0] for n in range(20)])
+        assert np.allclose(x.scalars('ft'), si/0.3048)
+
+def test_grader():
+    import os, tempfile
+    import numpy as np
+    from types import SimpleNamespace
+    from answerkey import AnswerKey, AnswerKeyWriter, export_answers
+    from grader import grade, grade_assignment
+    from quantity import Quantity
+    print('grader test')
+    ass = Assignment((dbprobs.P01, dbprobs.P05, dbprobs.P07, dbprobs.P09), 'Grading', seed=8)
+    ass.rng(len(ass))
+    with tempfile.TemporaryDirectory() as tmp:
+        key = AnswerKey(export_answers(ass, 6, tmp))
+        w = key.column(dbprobs.P01.title, 'w')
+        cumsum = key.column(dbprobs.P05.title, 'w')
+        x = key.column(dbprobs.P07.title, 'x')
+        feet = x.scalars('ft')
+        submissions = [
+            # all right, the distance unitless in the student's own units
+            (0, dbprobs.P01.title, 'w', w[0]),
+            (0, dbprobs.P05.title, 'w', cumsum[0]),
+            (0, dbprobs.P07.title, 'x', np.asarray(x[0])),
+            # a wrong sum, the distance in feet
+            (1, dbprobs.P01.title, 'w', w[1] + 1),
+            (1, dbprobs.P07.title, 'x', feet[1], 'ft'),
+            # a distance off by 0.5%, in seconds, and in unknown units
+            (2, dbprobs.P07.title, 'x', feet[2]*1.005, 'ft'),
+            (3, dbprobs.P07.title, 'x', feet[3], 's'),
+            (4, dbprobs.P07.title, 'x', feet[4], 'flurbs'),
+            # a wrong answer corrected, and an unknown student and output
+            (5, dbprobs.P01.title, 'w', 0),
+            (5, dbprobs.P01.title, 'w', w[5]),
+            (99, dbprobs.P01.title, 'w', 0),
+            (5, dbprobs.P01.title, 'q', 0),
+            ]
+        grades = grade(key, submissions)
+        assert grades.status.tolist() == ['correct']*3 + ['incorrect', 'correct', 'correct']\
+            + ['bad units']*2 + ['incorrect', 'correct', 'unknown student', 'unknown output']
+        # units on a plain number must be dimensionless
+        plain = grade(key, [(0, dbprobs.P01.title, 'w', w[0], 'm'),
+                            (1, dbprobs.P01.title, 'w', w[1], '')])
+        assert plain.status.tolist() == ['bad units', 'correct']
+        for lookup in (key.student, grades.student):
+            try:
+                lookup(99)
+            except KeyError:
+                pass
+            else:
+                raise AssertionError('found a student not in the key')
+    assert grades.problems == [p.title for p in ass.problems]
+    # P09 has no solver outputs so is not graded
+    points = dbprobs.P01.points + dbprobs.P05.points + dbprobs.P07.points
+    assert (grades.out_of == points).all()
+    assert grades.scores.tolist() == [points, dbprobs.P07.points, dbprobs.P07.points,
+                                      0, 0, dbprobs.P01.points]
+    assert not grade(key, submissions[5:6], rtol=1e-3).correct[(dbprobs.P07.title, 'x')][2]
+    assert grades.student(1) == {dbprobs.P01.title: (0, dbprobs.P01.points),
+                                 dbprobs.P05.title: (0, dbprobs.P05.points),
+                                 dbprobs.P07.title: (dbprobs.P07.points, dbprobs.P07.points)}
+    # recomputed answers grade the same, for the students who submitted
+    recomputed = grade_assignment(ass, 6, submissions)
+    assert recomputed.students.tolist() == [0, 1, 2, 3, 4, 5]
+    assert (recomputed.scores == grades.scores).all()
+    assert recomputed.status.tolist() == grades.status.tolist()
+    # a student outside a planned class
+    planned = Assignment(ass.problems, ass.title, seed=ass.seed)
+    planned.plan(6, 3, max_shared=6)
+    outside = grade_assignment(planned, 6, [(6, dbprobs.P01.title, 'w', 0)])
+    assert outside.status.tolist() == ['unknown student'] and len(outside.students) == 0
+    # a value without units in a column of quantities is taken as it is
+    mixed = Assignment((dbprobs.P07,), 'Mixed', seed=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        with AnswerKeyWriter(mixed, tmp) as writer:
+            for n, x, y in ((0, Quantity([3.], 'ft'), Quantity([1., 2.], 'ft')),
+                            (1, np.array([2.]), np.array([1., 2.]))):
+                writer.add(n, mixed.problems, [SimpleNamespace(dct={'x': SimpleNamespace(value=x),
+                                                                    'y': SimpleNamespace(value=y)})])
+        key = AnswerKey(tmp)
+        assert np.allclose(key.column(dbprobs.P07.title, 'x').scalars('m'), [0.9144, 2.])
+        mixed_grades = grade(key, [(1, dbprobs.P07.title, 'x', 2.),
+                                   (1, dbprobs.P07.title, 'y', [1., 2.]),
+                                   (0, dbprobs.P07.title, 'y', [1., 2.], 'ft')])
+        assert mixed_grades.status.tolist() == ['correct']*3
+
+def test_instrument():
+    import json, os, tempfile
+    import instrument
+    print('instrumentation test')
+    ass = Assignment(dbprobs.A01.problems, dbprobs.A01.title, seed=7)
+    ass.rng(len(ass))
+    for workers in (1, 2):
+        with instrument.recording() as recorder:
+            output2latex(ass, 5, workers=workers)
+        stages = {r[0] for r in recorder.records}
+        assert stages == {'draw', 'solve', 'view', 'render', 'write', 'output2latex'}
+        report = recorder.report(slowest=2)
+        assert report['stages']['solve']['count'] == 5*len(ass.subset)
+        assert report['stages']['render']['count'] == 2*5
+        s = report['stages']['draw']
+        assert s['p50'] <= s['p90'] <= s['p99'] <= s['max'] <= s['total']
+        assert len(report['slowest_problems']) == 2
+        assert {p['problem'] for p in report['slowest_problems']} <= {p.title for p in ass.subset}
+        print(recorder.format_report())
+    with tempfile.TemporaryDirectory() as tmp:
+        recorder.write_report(os.path.join(tmp, 'report.json'))
+        assert json.load(open(os.path.join(tmp, 'report.json'))) == recorder.report()
+    # nothing is kept outside a recording
+    assert not instrument.recorder.enabled
+    output2latex(ass, 2)
+    assert instrument.recorder.drain() == []
+
+def test_latex2pdf():
+    import os, stat, tempfile
+    from outputroutines import latex2pdf
+    print('concurrent pdflatex test with a fake pdflatex')
+    fake = (
+        '#!/bin/sh\n'
+        'for arg; do case $arg in\n'
+        '    -output-directory=*) dir=${arg#*=};;\n'
+        '    -*) ;;\n'
+        '    *) tex=$arg;;\n'
+        'esac; done\n'
+        'name=$(basename "$tex" .tex)\n'
+        'echo "log of $tex" > "$dir/$name.log"\n'
+        'echo "aux of $tex" > "$dir/shared.aux"\n'
+        'if grep -q SLOW "$tex"; then sleep 10; fi\n'
+        'if grep -q FAIL "$tex"; then exit 1; fi\n'
+        'echo "%PDF of $tex" > "$dir/$name.pdf"\n')
+    with tempfile.TemporaryDirectory() as tmp:
+        pdflatex = os.path.join(tmp, 'pdflatex')
+        with open(pdflatex, 'w') as _:
+            _.write(fake)
+        os.chmod(pdflatex, stat.S_IRWXU)
+        files = []
+        for name, body in (('a', 'ok'), ('b', 'FAIL'), ('c', 'SLOW'), ('d', 'ok')):
+            files.append(os.path.join(tmp, name + '.tex'))
+            with open(files[-1], 'w') as _:
+                _.write(body)
+        out = os.path.join(tmp, 'out')
+        results = latex2pdf(files, jobs=4, timeout=1, output_directory=out,
+                            pdflatex=pdflatex)
+        for result in results:
+            print(result)
+        assert [r.tex for r in results] == files
+        a, b, c, d = results
+        assert a.returncode == 0 and open(a.pdf).read() == f'%PDF of {files[0]}\n'
+        assert open(d.log).read() == f'log of {files[3]}\n'
+        assert b.returncode == 1 and b.pdf is None and b.log is not None
+        assert c.timed_out and c.returncode is None and c.duration < 5
+        assert sorted(os.listdir(out)) == ['a.log', 'a.pdf', 'b.log', 'c.log', 'd.log', 'd.pdf']
+
+def test_bundle():
+    import json, os, stat, tempfile
+    from outputroutines import output2bundle, bundle2pdf, read_page_index
+    print('bundle test with a fake pdflatex')
+    ass = Assignment(dbprobs.A01.problems, dbprobs.A01.title, seed=5)
+    ass.rng(len(ass))
+    name_a, name_s = output2bundle(ass, 4)
+    single = output2latex(ass, 4)
+    for name, is_soln in ((name_a, False), (name_s, True)):
+        text = open(name).read()
+        assert text.count('\\documentclass') == 1
+        # \maketitle, \title and \date only work once per document
+        assert text.count('\\studenttitle{') == 4
+        assert '\\maketitle' not in text and '\\date' not in text and '\\title' not in text
+        for n in range(4):
+            assert f'\\studenttitle{{Assignment {ass.title} \\\\ Student ID {n}}}' in text
+        for n in range(4):
+            # each student gets the same problems as in its own document
+            own = open(single[2*n + is_soln]).read()
+            body = own[own.index('\\section'):own.index('\\end{document}')].strip()
+            assert body in text
+    # two pages per student
+    fake = (
+        '#!/bin/sh\n'
+        'for arg; do case $arg in\n'
+        '    -output-directory=*) dir=${arg#*=};;\n'
+        '    -*) ;;\n'
+        '    *) tex=$arg;;\n'
+        'esac; done\n'
+        'name=$(basename "$tex" .tex)\n'
+        'grep -o "Student ID [0-9]*" "$tex" | awk \'{print $3, 2*NR-1} END {print "end", 2*NR}\' > "$dir/$name.pages"\n'
+        'echo "%PDF of $tex" > "$dir/$name.pdf"\n')
+    with tempfile.TemporaryDirectory() as tmp:
+        pdflatex = os.path.join(tmp, 'pdflatex')
+        with open(pdflatex, 'w') as _:
+            _.write(fake)
+        os.chmod(pdflatex, stat.S_IRWXU)
+        (result, index), = bundle2pdf([name_a], output_directory=tmp, pdflatex=pdflatex)
+        assert result.returncode == 0
+        assert json.load(open(index)) == {str(n): [2*n + 1, 2*n + 2] for n in range(4)}
+        assert read_page_index(index[:-len('.json')] + '.pages')[3] == (7, 8)
+
 def test_all_output2pdf():
     for ass in assignments:
         output2pdf(ass, 1)
@@ -45,6 +497,17 @@ def test_RandomUnit():
     print(ru.value)
     print('random unit conversion factor from previous to current value')
     print(ru.conversion_factor)
+    import numpy as np
+    from quantity import eval_conversion_factor
+    assert RandomUnit.from_unit_dimensionality('kg*m^2*s^-2').table is ru.table
+    for _ in range(20):
+        ru.rng()
+        assert np.isclose(ru.conversion_factor,
+                          eval_conversion_factor(ru.unit_set[0])/eval_conversion_factor(ru.value))
+        assert str(ru) == unit_str(ru.value)
+    factors = ru.rng_cohort(50)
+    ru.select(7)
+    assert factors[7] == ru.conversion_factor and ru.value is ru.unit_set[ru.cohort[7]]
 
 def test_RandomQuantity():
     print('random quantity test')
@@ -55,6 +518,33 @@ def test_RandomQuantity():
     res = rq.value*rq.value
     print(res)
 
+def test_rng_cohort():
+    import numpy as np
+    print('cohort draw test')
+    ri = RandomInteger('ri', 1, 10, size=(2, 3))
+    ri.rng_cohort(50)
+    assert ri.cohort.shape == (50, 2, 3) and ri.cohort.dtype.kind == 'i'
+    assert ri.cohort.min() >= 1 and ri.cohort.max() <= 10
+    ri.select(7)
+    assert (ri.value == ri.cohort[7]).all()
+
+    rr = RandomReal('rr', 1e-3, 1e3, precision=2, log_uniform=True)
+    rr.rng_cohort(1000)
+    assert rr.cohort.shape == (1000, 1)
+    assert (rr.cohort == prec_round(rr.cohort, 2)).all()
+    assert rr.cohort.min() >= 1e-3*0.99 and np.median(rr.cohort) < 10
+
+    rsize = RandomSize( ((3,4),) )
+    rq = RandomQuantity('rq', 2, 5, rsize, RandomUnit(['kg/m','lb/ft','g/cm']), 3)
+    rq.rng_cohort(20)
+    for n in range(20):
+        rq.select(n)
+        assert len(rq.value) == rsize.value[0]
+        assert rq.value.units is Quantity(1, rq.unit.value).units
+        # drawn in the first unit of the set, then converted
+        base = np.asarray(rq.value)/rq.unit.conversion_factor
+        assert ((base > 1.99) & (base < 5.01)).all()
+
 def test_ConstantReal():
     print('constant float test')
     rq2 = ConstantReal('a', 2350)
@@ -88,12 +578,142 @@ def test_Quantity():
         print(f'caught a {type(e)}')
         print(e)
 
-from unitparse import exprStack, BNF, evaluate_stack, ParseException
+def test_Unit():
+    from quantity import Unit
+    print('Unit interning test')
+    u = Unit.intern('kg*m/s^2')
+    assert u is Unit.intern({'kg': 1, 'm': 1, 's': -2})
+    assert u is Quantity([1], 'kg*m*s^-2').units
+    print(u, u.dim, u.factor)
+    assert u.dim == (1, 1, -2, 0, 0, 0, 0)
+    assert u.dim is Unit.intern('g*cm/s^2').dim
+    q = Quantity([1, 2], 'kg/m')
+    assert (q**2).units is Unit.intern('kg^2/m^2')
+    try:
+        q + Quantity([1, 2], 'kg/s')
+    except DimensionMismatchError as e:
+        print(f'caught a {type(e)}')
+        print(e)
+    else:
+        raise AssertionError('kg/m + kg/s should not add')
+    # zero has any dimension, with or without units
+    for zero in (Quantity(0., 's'), Quantity(0., '')):
+        r = Quantity(2., 'm') + zero
+        assert r.units is Unit.intern('m') and r.tolist() == 2.
+
+def test_Quantity_numpy():
+    import numpy as np
+    from quantity import Unit, DIMENSIONLESS
+    print('Quantity NumPy protocol test')
+    x = Quantity([1., 4., 9.], 'm')
+    t = Quantity([1., 2., 3.], 's')
+    assert np.sqrt(x).units is Unit.intern('m^0.5')
+    assert np.allclose(np.sqrt(x), [1, 2, 3])
+    assert (x/t).units is Unit.intern('m/s') and np.divide(x, t).units is Unit.intern('m/s')
+    assert np.matmul(x, t).units is Unit.intern('m*s')
+    assert np.dot(x, t).units is Unit.intern('m*s')
+    assert np.sum(x).units is x.units and float(np.sum(x)) == 14
+    assert np.cumsum(x).units is x.units and np.mean(x).units is x.units
+    assert np.std(x).units is x.units
+    assert np.prod(x).units is Unit.intern('m^3')
+    assert np.max(x).units is x.units and x[1:].units is x.units
+    assert np.concatenate([x, Quantity([100.], 'cm')]).tolist() == [1, 4, 9, 1]
+    assert np.linalg.norm(x).units is x.units
+    # additive ufuncs and comparisons convert to the first operand's units
+    km = Quantity([1.], 'km')
+    assert np.add(km, Quantity([500.], 'm')).tolist() == [1.5]
+    assert (km + Quantity([500.], 'm')).tolist() == [1.5]
+    assert np.all(km > Quantity([999.], 'm')) and type(km > 0) is np.ndarray
+    assert np.allclose(np.log(Quantity([2.], 'km/m')), np.log(2000.))
+    for f in (lambda: np.exp(x), lambda: np.add(x, t), lambda: x**t,
+              lambda: np.maximum(x, t)):
+        try:
+            f()
+        except DimensionMismatchError:
+            pass
+        else:
+            raise AssertionError('dimensions should not match')
+    # out= and in place write into the Quantity and keep it a Quantity
+    y = Quantity([1., 2., 3.], 'm')
+    before = y.__array_interface__['data'][0]
+    assert np.multiply(y, t, out=y) is y and y.units is Unit.intern('m*s')
+    y *= t
+    assert y.units is Unit.intern('m*s^2') and y.tolist() == [1, 8, 27]
+    assert y.__array_interface__['data'][0] == before
+    s = Quantity(2., 'm')
+    s *= 3
+    assert float(s) == 6 and s.units is Unit.intern('m')
+    np.sqrt(y, out=y)
+    assert y.units is Unit.intern('m^0.5*s')
+    # plain operands into a Quantity out give a dimensionless result
+    o = Quantity(np.zeros(2), 'm')
+    assert np.add(np.ones(2), np.ones(2), out=o) is o
+    assert o.tolist() == [2, 2] and o.units is DIMENSIONLESS
+    # sign is defined for any units
+    sign = np.sign(Quantity([-3., 0., 2.], 'm'))
+    assert type(sign) is np.ndarray and sign.tolist() == [-1, 0, 1]
+    c = np.clip(Quantity([.5, 3., 20.], 'm'), Quantity(1., 'm'), Quantity(.01, 'km'))
+    assert c.units is Unit.intern('m') and c.tolist() == [1, 3, 10]
+    try:
+        np.clip(Quantity([1.], 'm'), Quantity(1., 's'), None)
+    except DimensionMismatchError:
+        pass
+    else:
+        raise AssertionError('clipped metres to seconds')
+
+def test_Quantity_reflected():
+    import numpy as np
+    from quantity import Unit, DIMENSIONLESS
+    print('reflected Quantity operators test')
+    x = Quantity([1., 2., 4.], 'm/s')
+    assert (0 - x).tolist() == [-1, -2, -4] and (0 - x).units is x.units
+    assert (10 - x).tolist() == [9, 8, 6]
+    assert (1/x).tolist() == [1, .5, .25] and (1/x).units is Unit.intern('s/m')
+    assert np.allclose(2**Quantity([1.], ''), 2) and type(2**Quantity([1.], '')) is np.ndarray
+    try:
+        2**x
+    except DimensionMismatchError:
+        pass
+    else:
+        raise AssertionError('dimensioned exponent')
+    # results share the interned units, and a trusted view does not copy
+    assert (x*x).units is (x*x).units is Unit.intern('m^2/s^2')
+    a = np.arange(3.)
+    q = Quantity._from_trusted(a, DIMENSIONLESS)
+    assert np.shares_memory(a, q) and q.units is DIMENSIONLESS
+
+def test_conversion_plan():
+    import numpy as np
+    from quantity import (Unit, conversion_plan, conversion_cache_info,
+                          convert_values, convert_all)
+    print('cached unit conversion test')
+    plan = conversion_plan('km/hr', 'm/s')
+    assert np.isclose(plan.factor, 1/3.6) and plan.units is Unit.intern('m/s')
+    hits = conversion_cache_info().hits
+    assert conversion_plan('km/hr', 'm/s') is plan
+    assert conversion_cache_info().hits == hits + 1
+    assert conversion_plan('lbf').units is conversion_plan('N').units
+    try:
+        conversion_plan('m', 's')
+    except DimensionMismatchError:
+        pass
+    else:
+        raise AssertionError('converted metres to seconds')
+    v = np.array([3.6, 36.])
+    assert np.allclose(convert_values(v, 'km/hr', 'm/s'), [1, 10])
+    convert_values(v, 'km/hr', 'm/s', out=v)
+    assert np.allclose(v, [1, 10])
+    qs = convert_all([Quantity(3.6, 'km/hr'), Quantity([1., 2.], 'm/s'),
+                      Quantity(60., 'm/min')], 'm/s')
+    assert all(q.units is plan.units for q in qs)
+    assert np.allclose(np.concatenate([np.atleast_1d(q) for q in qs]), [1, 1, 2, 1])
+
+from unitparse import expr_stack, BNF, evaluate_stack, ParseException
 
 def test_unitparse():
 
     def test(s):
-        exprStack[:] = []
+        expr_stack()[:] = []
         try:
             results = BNF().parseString(s, parseAll=True)
             return results
@@ -126,6 +746,112 @@ def test_unit():
         l = [l[i] + d[i] for i in range(len(d))]
     print(l)
 
+def test_unit_snapshot():
+    import os, tempfile
+    from unit import build_snapshot, load_snapshot, walk_registry, conv
+    print('testing unit registry snapshot round trip')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = build_snapshot(os.path.join(tmp, 'units.npy'))
+        table = load_snapshot(path)
+        d, c = walk_registry()
+        assert list(table['name']) == sorted(d)
+        assert all(tuple(x['dim']) == d[x['name']] for x in table)
+        assert all(x['conv'] == c[x['name']] for x in table)
+        del table
+    assert dict(dim) == d and dict(conv) == c
+
+def test_eval_units_cache():
+    import threading
+    from unitparse import unit_cache_info, unit_cache_clear, FrozenUnits
+    print('testing eval_units cache and thread safety')
+    unit_cache_clear()
+    strings = ('kg*m/s^2', '(kg/m)*(m/s)', 'GPa', 'm*s^-2', '(kg*m)^1.5/s')
+    expected = {s: dict(eval_units(s)) for s in strings}
+    assert unit_cache_info().misses == len(strings)
+    results = []
+    def worker():
+        for _ in range(200):
+            for s in strings:
+                results.append(eval_units(s) == expected[s])
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(results)
+    print(unit_cache_info())
+    assert unit_cache_info().hits == 4*200*len(strings)
+    u = eval_units('GPa')
+    assert type(u) is FrozenUnits and hash(u) == hash(eval_units('GPa'))
+    try:
+        u['GPa'] = 2
+    except TypeError:
+        pass
+    else:
+        raise AssertionError('cached units must be immutable')
+
+def test_compile_units():
+    from unitparse import compile_units, parse_units_pyparsing, str2dict, UnitParseError
+    print('testing unit compiler against the pyparsing grammar')
+    for string in ('kg*m/s^2',
+                   '(kg/m)*(m/s)',
+                   '(kg^-1/m)*(s/m^-1)',
+                   '(kg*m)^1.5/s',
+                   '(kg/m/ft)*(BTU^2)^3',
+                   '(kg/m/ft)*BTU^2^3',
+                   'm*s^-2',
+                   'GPa',
+                   ' kg / m / ft ',
+                   'm^1e2'):
+        f = compile_units(string)
+        print(string, f)
+        assert f == str2dict(parse_units_pyparsing(string))
+    assert compile_units('BTU^2^3') == {'BTU': 8}
+    for string in ('2*m', 'm^', '(m', 'm)', 'm kg', 'm+s', 'm^x'):
+        try:
+            compile_units(string)
+        except UnitParseError as e:
+            print(f'caught a {type(e)}')
+            print(e)
+        else:
+            raise AssertionError(f'{string} should not compile')
+
+def test_prec_round():
+    import numpy as np
+    from utils import prec_round, prec_round_scalar
+    print('vectorized significant figure rounding test')
+    a = np.array([0., -0., np.nan, np.inf, -3.14159, 2350, 1e-300, 9.9996, -0.00099996])
+    for precision in (0, 2, 3):
+        expected = [prec_round_scalar(x, precision) for x in a]
+        r = prec_round(a, precision)
+        print(r)
+        assert np.array_equal(r, expected, equal_nan=True)
+        assert (np.signbit(r) == np.signbit(expected)).all()
+    a = np.random.normal(size=(50, 3))*10.**np.random.randint(-5, 5, (50, 3))
+    r = prec_round(a, 3)
+    assert r.shape == a.shape
+    assert np.array_equal(r, [[prec_round_scalar(x, 3) for x in row] for row in a])
+    # ties in the last kept digit round as the scalar version does
+    ties = np.array([86.125, 86.995, 13.595, -501.55, 2830.5])
+    assert prec_round(ties, 3).tolist() == [86.13, 87.0, 13.6, -501.6, 2830.0]
+    a = np.round(np.random.uniform(-1000, 1000, 2000), 3)
+    for precision in (2, 3, 14):
+        assert np.array_equal(prec_round(a, precision),
+                              [prec_round_scalar(x, precision) for x in a])
+
+def test_format_plan():
+    import numpy as np
+    from utils import texfmt
+    plan = format_plan('Sum $${x_autofmt}$$ and {y.value}, {{not}} {w}.')
+    assert plan.fields == {'y', 'w'} and plan.autofmt == {'x'}
+    assert format_plan(plan.text) is plan
+    for prob in problems:
+        prob.solve()
+        for text in (prob.statement, prob.solution):
+            full = {**prob.dct, **{k + '_autofmt': texfmt(v.value) for k, v in prob.dct.items()}}
+            assert format_plan(text).render(prob.dct) == text.format_map(full)
+    assert texfmt(np.array([[1, 2], [3, 4]])) == '\\begin{pmatrix}\n1&2\\\\3&4\\\\\\end{pmatrix}\n'
+
 def test_str():
     for v in (1, [1], [1, 2]):
         print(v, ConstantReal('', v), end='\n\n')
@@ -134,17 +860,42 @@ def test_str():
 
 if __name__ == '__main__':
     test_all_assignments()
+    test_sample_subset()
+    test_plan()
+    test_manifest()
     test_all_problems()
     test_all_output2latex()
+    test_all_output2latex_cohort()
+    test_binding()
+    test_solve_cohort()
+    test_solver_cache()
+    test_output2latex_parallel()
+    test_output2latex_seeded()
+    test_iter_output2latex()
+    test_answer_key()
+    test_grader()
+    test_instrument()
+    test_latex2pdf()
+    test_bundle()
     
     test_RandomUnit()
     test_RandomQuantity()
+    test_rng_cohort()
     test_ConstantReal()
 
     test_Quantity()
+    test_Quantity_numpy()
+    test_Quantity_reflected()
+    test_conversion_plan()
+    test_Unit()
 
     test_unitparse()
 
     test_unit()
+    test_unit_snapshot()
+    test_eval_units_cache()
+    test_compile_units()
 
+    test_prec_round()
+    test_format_plan()
     test_str()
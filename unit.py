@@ -1,38 +1,184 @@
-#access hidden methods by the class name
-from quantities import *
-from quantities.registry import unit_registry
-r = unit_registry._UnitRegistry__Registry
-d = r._Registry__shared_state
-d = d['_Registry__context']
+"""
+Unit registry tables derived from the python-quantities registry.
+
+``dim`` maps a unit name to its 7-tuple dimension (kg, m, s, A, K, cd, mol),
+``conv`` maps a unit name to its SI conversion factor and ``idim`` maps a
+dimension tuple to all unit names having it.
+
+Walking the quantities registry and simplifying every unit is slow, so the
+tables are built once into a snapshot (a structured ``.npy`` file keyed on
+the quantities version and the snapshot format) and memory mapped on
+import. All processes importing
+this module then share one read-only copy. Run ``python unit.py`` to build
+the snapshot ahead of time.
+"""
+import os
+from collections.abc import Mapping
+from importlib.metadata import version
+
+import numpy as np
 
 nulldim = (0, 0, 0, 0, 0, 0, 0)
 
-dim = {}
-conv = {}
-for k, v in d.items():
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'unitcache')
+
+# bump whenever walk_registry or the table layout changes, so that
+# snapshots built by older code are not reused
+SNAPSHOT_FORMAT = 1
+
+
+def snapshot_path(directory=SNAPSHOT_DIR):
+    """Path of the snapshot for the installed quantities version and format."""
+    return os.path.join(directory, f'units-v{SNAPSHOT_FORMAT}-'
+                                   f'quantities-{version("quantities")}.npy')
+
+
+def walk_registry():
+    """Builds the ``dim`` and ``conv`` dicts from the quantities registry."""
+    # access hidden methods by the class name
+    from quantities.registry import unit_registry
+    r = unit_registry._UnitRegistry__Registry
+    d = r._Registry__shared_state
+    d = d['_Registry__context']
+
+    dim = {}
+    conv = {}
+    for k, v in d.items():
+        try:
+            v = v.simplified
+            d = {k.symbol.lower():v for k, v in dict(v.dimensionality).items()}
+            d = {**d, **{k.name.lower():v for k, v in dict(v.dimensionality).items()}}
+            dim[k] = (d['kg'] if 'kg' in d.keys() else 0,
+                      d['m'] if 'm' in d.keys() else 0,
+                      d['s'] if 's' in d.keys() else 0,
+                      d['A'] if 'A' in d.keys() else 0,
+                      d['K'] if 'K' in d.keys() else 0,
+                      d['cd'] if 'cd' in d.keys() else 0,
+                      d['mol'] if 'mol' in d.keys() else 0)
+            dim[k] = tuple(int(x) for x in dim[k])
+            conv[k] = float(v.magnitude)
+        except Exception as e:
+            pass
+    return dim, conv
+
+
+def build_table():
+    """Walks the quantities registry into a structured array sorted by name.
+
+    The records are sorted so that lookups can bisect the name column.
+    """
+    dim, conv = walk_registry()
+    names = sorted(dim)
+    table = np.zeros(len(names), dtype=[('name', f'U{max(map(len, names))}'),
+                                        ('dim', 'i1', (7,)),
+                                        ('conv', 'f8')])
+    table['name'] = names
+    table['dim'] = [dim[k] for k in names]
+    table['conv'] = [conv[k] for k in names]
+    return table
+
+
+def build_snapshot(path=None):
+    """Writes the snapshot to `path`.
+
+    The file is written to a temporary name and moved into place, so
+    concurrent builders never expose a partial snapshot.
+    """
+    if path is None:
+        path = snapshot_path()
+    table = build_table()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as _:
+        np.save(_, table)
+    os.replace(tmp, path)
+    return path
+
+
+def load_snapshot(path=None):
+    """Memory maps the snapshot, building it first if it does not exist."""
+    if path is None:
+        path = snapshot_path()
     try:
-        v = v.simplified
-        mag = v.magnitude
-        d = {k.symbol.lower():v for k, v in dict(v.dimensionality).items()}
-        d = {**d, **{k.name.lower():v for k, v in dict(v.dimensionality).items()}}
-        dim[k] = (d['kg'] if 'kg' in d.keys() else 0,
-                  d['m'] if 'm' in d.keys() else 0,
-                  d['s'] if 's' in d.keys() else 0,
-                  d['A'] if 'A' in d.keys() else 0,
-                  d['K'] if 'K' in d.keys() else 0,
-                  d['cd'] if 'cd' in d.keys() else 0,
-                  d['mol'] if 'mol' in d.keys() else 0)
-        dim[k] = tuple(int(x) for x in dim[k])
-        conv[k] = float(v.magnitude)
-    except Exception as e:
+        return np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
         pass
+    try:
+        build_snapshot(path)
+    except OSError:
+        # read-only install, keep the tables in this process only
+        return build_table()
+    return np.load(path, mmap_mode='r')
+
+
+class SnapshotTable(Mapping):
+    """Read-only unit name mapping over one column of the snapshot.
+
+    Lookups bisect the sorted name column and are memoized, so only the
+    units actually used by a process are ever materialized.
+    """
+
+    def __init__(self, names, values, convert):
+        self._names = names
+        self._values = values
+        self._convert = convert
+        self._memo = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        if not isinstance(key, str):
+            raise KeyError(key)
+        i = int(np.searchsorted(self._names, key))
+        if i == len(self._names) or self._names[i] != key:
+            raise KeyError(key)
+        value = self._convert(self._values[i])
+        self._memo[key] = value
+        return value
+
+    def __iter__(self):
+        return (str(k) for k in self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+class DimensionIndex(Mapping):
+    """Dimension tuple to unit names, grouped on first access."""
+
+    def __init__(self, dim):
+        self._dim = dim
+        self._groups = None
+
+    def _index(self):
+        if self._groups is None:
+            groups = {}
+            for k, v in self._dim.items():
+                if v not in groups.keys():
+                    groups[v] = []
+                groups[v].append(k)
+            # for hashable types
+            self._groups = {k: tuple(v) for k, v in groups.items()}
+        return self._groups
+
+    def __getitem__(self, key):
+        return self._index()[key]
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __len__(self):
+        return len(self._index())
+
 
-idim = {}
-for k, v in dim.items():
-    if v not in idim.keys():
-        idim[v] = []
-    idim[v].append(k)
+snapshot = load_snapshot()
+dim = SnapshotTable(snapshot['name'], snapshot['dim'],
+                    lambda x: tuple(int(i) for i in x))
+conv = SnapshotTable(snapshot['name'], snapshot['conv'], float)
+idim = DimensionIndex(dim)
 
-# for hashable types
-for k in idim:
-    idim[k] = tuple(idim[k])
+if __name__ == '__main__':
+    print(build_snapshot())
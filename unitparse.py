@@ -1,59 +1,71 @@
-"""Taken from pyparsing docs."""
+"""
+Unit expression parsing.
 
-from pyparsing import (
-    Literal,
-    Word,
-    Group,
-    Forward,
-    alphas,
-    alphanums,
-    Regex,
-    ParseException,
-    Suppress
-)
+Unit strings such as ``'kg*m/s^2'`` or ``'(kg*m)^1.5/s'`` are compiled to
+dicts of unit exponents by a hand-written tokenizer and precedence-climbing
+compiler. The grammar is the one of the original pyparsing calculator (taken
+from the pyparsing docs), which is kept as an optional fallback (see
+`use_pyparsing`): ``*`` and ``/`` are left associative, ``^`` is right
+associative and binds tighter, so ``BTU^2^3`` is ``BTU^8``.
+"""
 
-exprStack = []
+import re
+import threading
+from functools import lru_cache
 
+try:
+    from pyparsing import (
+        Literal,
+        Word,
+        Group,
+        Forward,
+        alphas,
+        alphanums,
+        Regex,
+        ParseException,
+        Suppress
+    )
+except ImportError:
+    pyparsing_available = False
+else:
+    pyparsing_available = True
 
-def push_first(toks):
-    exprStack.append(toks[0])
 
+class UnitParseError(ValueError):
+    pass
 
-def push_unary_minus(toks):
-    for t in toks:
-        if t == "-":
-            exprStack.append("unary -")
-        else:
-            break
 
+if not pyparsing_available:
+    ParseException = UnitParseError
 
-bnf = None
 
+class FrozenUnits(dict):
+    """Immutable, hashable unit dict as returned by `eval_units`.
 
-def BNF():
-    global bnf
-    if not bnf:
-        fnumber = Regex(r"[+-]?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?")
-        ident = Word(alphas, alphanums + "_$")
+    Results of `eval_units` are cached and shared between callers, so they
+    must not be modified in place.
+    """
 
-        plus, minus = map(Literal, "*/")
-        lpar, rpar = map(Suppress, "()")
-        addop = plus | minus
-        multop = Literal("^")
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f'{type(self).__name__} is immutable')
 
-        expr = Forward()
-        aatom = (fnumber | ident).setParseAction(push_first)
-        pgroup = Group(lpar + expr + rpar)
-        atom = (addop[...] + (aatom | pgroup)).setParseAction(push_unary_minus)
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.items()))
+            return self._hash
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict.__repr__(self)})'
 
-        # by defining exponentiation as "atom [ ^ factor ]..." instead of "atom [ ^ atom ]...", we get right-to-left
-        # exponents, instead of left-to-right that is, 2^3^2 = 2^(3^2), not
-        # (2^3)^2.
-        factor = Forward()
-        factor <<= atom + (multop + factor).setParseAction(push_first)[...]  
-        expr <<= factor + (addop + factor).setParseAction(push_first)[...]
-        bnf = expr
-    return bnf
 
 def str2dict(x):
     """Converts string to dict or passes dict type through."""
@@ -72,39 +84,19 @@ def linscale(x, y):
 def linadd(x, y):
     x = str2dict(x)
     y = str2dict(y)
-    k1 = set(x.keys())
-    k2 = set(y.keys())
-    inter = k1.intersection(k2)
-    diff1 = k1.difference(k2)
-    diff2 = k2.difference(k1)
-    d = {}
-    for k in inter:
-        d[k] = x[k] + y[k]
-    for k in diff1:
-        d[k] = x[k]
-    for k in diff2:
-        d[k] = y[k]
-
-    return d 
+    d = dict(x)
+    for k, v in y.items():
+        d[k] = d[k] + v if k in d else v
+    return d
 
 
 def linsubtract(x, y):
     x = str2dict(x)
     y = str2dict(y)
-    k1 = set(x.keys())
-    k2 = set(y.keys())
-    inter = k1.intersection(k2)
-    diff1 = k1.difference(k2)
-    diff2 = k2.difference(k1)
-    d = {}
-    for k in inter:
-        d[k] = x[k] - y[k]
-    for k in diff1:
-        d[k] = x[k]
-    for k in diff2:
-        d[k] = -y[k]
-
-    return d 
+    d = dict(x)
+    for k, v in y.items():
+        d[k] = d[k] - v if k in d else -v
+    return d
 
 
 opn = {"*": linadd,
@@ -112,6 +104,178 @@ opn = {"*": linadd,
        "^": linscale}
 
 
+_token = re.compile(r"""\s*(?:
+    (?P<number>[+-]?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+    | (?P<ident>[A-Za-z][A-Za-z0-9_$]*)
+    | (?P<op>[*/^()])
+    )""", re.VERBOSE)
+
+# binary operator: (precedence, right associative)
+_binary = {"*": (1, False),
+           "/": (1, False),
+           "^": (2, True)}
+
+
+def tokenize(s):
+    """Splits a unit string into ``(kind, text)`` tokens."""
+    tokens = []
+    pos = 0
+    end = len(s.rstrip())
+    while pos < end:
+        m = _token.match(s, pos)
+        if m is None:
+            raise UnitParseError(f'unexpected character {s[pos:].lstrip()[:1]!r} '
+                                 f'in unit string {s!r}')
+        tokens.append((m.lastgroup, m.group(m.lastgroup)))
+        pos = m.end()
+    return tokens
+
+
+class _Compiler():
+    """Precedence-climbing compiler from tokens to unit exponent dicts.
+
+    Operands are either numbers or dicts owned by the compiler, so the dict
+    operations update their left operand in place.
+    """
+
+    def __init__(self, s):
+        self.s = s
+        self.tokens = tokenize(s)
+        self.pos = 0
+
+    def error(self, msg):
+        return UnitParseError(f'{msg} in unit string {self.s!r}')
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def compile(self):
+        value = self.climb(1)
+        if self.pos < len(self.tokens):
+            raise self.error(f'unexpected {self.tokens[self.pos][1]!r}')
+        return value
+
+    def climb(self, min_precedence):
+        lhs = self.atom()
+        while True:
+            kind, op = self.peek()
+            if kind != 'op' or op not in _binary:
+                return lhs
+            precedence, right = _binary[op]
+            if precedence < min_precedence:
+                return lhs
+            self.pos += 1
+            rhs = self.climb(precedence if right else precedence + 1)
+            lhs = self.apply(op, lhs, rhs)
+
+    def atom(self):
+        # leading operators are accepted and ignored, as in the BNF
+        while self.peek() in (('op', '*'), ('op', '/')):
+            self.pos += 1
+        kind, text = self.peek()
+        self.pos += 1
+        if kind == 'number':
+            try:
+                return int(text)
+            except ValueError:
+                return float(text)
+        if kind == 'ident':
+            return {text: 1}
+        if text == '(':
+            value = self.climb(1)
+            if self.peek() != ('op', ')'):
+                raise self.error("expected ')'")
+            self.pos += 1
+            return value
+        raise self.error('expected a unit or number' if kind is None
+                         else f'unexpected {text!r}')
+
+    def apply(self, op, lhs, rhs):
+        if op == '^':
+            if type(rhs) is dict:
+                raise self.error('exponent is not a number')
+            if type(lhs) is dict:
+                for k in lhs:
+                    lhs[k] = rhs*lhs[k]
+                return lhs
+            if type(lhs) is int:
+                return lhs**rhs
+            raise self.error(f'cannot raise {lhs} to a power')
+        if type(lhs) is not dict or type(rhs) is not dict:
+            raise self.error(f'numbers cannot be operands of {op!r}')
+        if op == '*':
+            for k, v in rhs.items():
+                lhs[k] = lhs[k] + v if k in lhs else v
+        else:
+            for k, v in rhs.items():
+                lhs[k] = lhs[k] - v if k in lhs else -v
+        return lhs
+
+
+def compile_units(s):
+    """Compiles a unit string to a dict of exponents (or a number)."""
+    return _Compiler(s).compile()
+
+
+#### pyparsing fallback ####
+
+# each thread parses onto its own stack, so parsing is reentrant
+_local = threading.local()
+
+
+def expr_stack():
+    """The expression stack of the calling thread."""
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def push_first(toks):
+    expr_stack().append(toks[0])
+
+
+def push_unary_minus(toks):
+    for t in toks:
+        if t == "-":
+            expr_stack().append("unary -")
+        else:
+            break
+
+
+bnf = None
+
+
+def BNF():
+    global bnf
+    if not pyparsing_available:
+        raise ImportError('the pyparsing fallback requires pyparsing')
+    if not bnf:
+        fnumber = Regex(r"[+-]?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?")
+        ident = Word(alphas, alphanums + "_$")
+
+        plus, minus = map(Literal, "*/")
+        lpar, rpar = map(Suppress, "()")
+        addop = plus | minus
+        multop = Literal("^")
+
+        expr = Forward()
+        aatom = (fnumber | ident).setParseAction(push_first)
+        pgroup = Group(lpar + expr + rpar)
+        atom = (addop[...] + (aatom | pgroup)).setParseAction(push_unary_minus)
+
+        # by defining exponentiation as "atom [ ^ factor ]..." instead of "atom [ ^ atom ]...", we get right-to-left
+        # exponents, instead of left-to-right that is, 2^3^2 = 2^(3^2), not
+        # (2^3)^2.
+        factor = Forward()
+        factor <<= atom + (multop + factor).setParseAction(push_first)[...]  
+        expr <<= factor + (addop + factor).setParseAction(push_first)[...]
+        bnf = expr
+    return bnf
+
 def evaluate_stack(s):
     op, num_args = s.pop(), 0
     if isinstance(op, tuple):
@@ -133,13 +297,53 @@ def evaluate_stack(s):
                 return op
 
 
-def eval_units(s):
-    if not s:
-        return {}
-
-    exprStack[:] = []
+def parse_units_pyparsing(s):
+    """Parses a unit string with the original pyparsing grammar."""
+    stack = expr_stack()
+    stack[:] = []
     BNF().parseString(s, parseAll=True)
-    r = evaluate_stack(exprStack[:])
+    return evaluate_stack(stack[:])
+
+
+UNIT_CACHE_SIZE = 1024
+
+
+_parse = compile_units
+
+
+def use_pyparsing(enable=True):
+    """Switches `eval_units` to the pyparsing fallback, or back."""
+    global _parse
+    if enable and not pyparsing_available:
+        raise ImportError('the pyparsing fallback requires pyparsing')
+    _parse = parse_units_pyparsing if enable else compile_units
+    unit_cache_clear()
+
+
+@lru_cache(maxsize=UNIT_CACHE_SIZE)
+def _eval_units(s):
+    r = _parse(s)
     if type(r) is str:
-        return {r:1}
+        return FrozenUnits({r:1})
+    if type(r) is dict:
+        return FrozenUnits(r)
     return r
+
+
+def eval_units(s):
+    """Parses a unit string into a dict of unit exponents.
+
+    Results are cached (see `unit_cache_info`) and returned as `FrozenUnits`.
+    """
+    if not s:
+        return FrozenUnits()
+    return _eval_units(s)
+
+
+def unit_cache_info():
+    """Hits, misses, maxsize and currsize of the `eval_units` cache."""
+    return _eval_units.cache_info()
+
+
+def unit_cache_clear():
+    _eval_units.cache_clear()
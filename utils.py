@@ -1,5 +1,7 @@
+import zlib
 import numpy as np
-def prec_round(a, precision=2):
+
+def prec_round_scalar(a, precision=2):
     if a == 0:
         return a
     else:
@@ -8,4 +10,151 @@ def prec_round(a, precision=2):
         c = np.log10(s * a) % 1
     return np.round(s * np.round(10**c, precision) * 10**m, 12)
 
-prec_round = np.vectorize(prec_round)
+# 10.0**m for integer m, by the same pow() as the scalar version
+_POW10_MIN = -330
+_POW10 = np.array([10.0**m for m in range(_POW10_MIN, 309)])
+
+def prec_round(a, precision=2):
+    """
+    Rounds to `precision` digits after the leading significant digit.
+
+    Whole-array version of `prec_round_scalar`, with exactly its results:
+    zeros are passed through, negative values are rounded by magnitude and
+    NaN (and inf) give NaN. Works on arrays of any shape, e.g.
+    (students, ...). NumPy's vectorized power can differ from the scalar
+    pow() in the last ulp, which changes the rounding of leading digits
+    close to a tie, so those are raised to the power one by one.
+    """
+    a = np.asarray(a, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        s = np.where(a > 0, 1., -1.)
+        l = np.log10(s * a)
+        finite = np.isfinite(l)
+        m = np.where(finite, l // 1, 0.)
+        c = l % 1
+        t = 10**c
+        scaled = t * 10.**precision
+        tie = np.abs(scaled - np.floor(scaled) - .5) < 1e-6 + 64*np.finfo(float).eps*scaled
+        redo = np.flatnonzero(tie & finite)
+        if len(redo):
+            t.flat[redo] = [10**x for x in c.flat[redo].tolist()]
+        r = np.round(s * np.round(t, precision) * _POW10[m.astype(np.intp) - _POW10_MIN], 12)
+    return np.where(a == 0, a, r)
+
+def stable_key(s):
+    """A key for a string that, unlike hash(), is the same in every process."""
+    return zlib.crc32(s.encode())
+
+def stream(seed, *key):
+    """
+    An independent generator for `key` (a tuple of non-negative ints) under
+    `seed`. Streams are cheap to create, so there can be one per student.
+    """
+    return np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=key)))
+
+def randbelow(n, generator):
+    """
+    A uniform integer in [0, n) for an arbitrarily large int `n`, from the
+    bytes of a numpy generator (or the numpy.random module).
+    """
+    bits = n.bit_length()
+    mask = (1 << bits) - 1
+    while True:
+        x = int.from_bytes(generator.bytes((bits + 7)//8), 'little') & mask
+        if x < n:
+            return x
+
+def subset_counts(points, k, high):
+    """
+    Counts of the subsets of `points` by item, size and total.
+
+    ``counts[i][j, s]`` is the number of subsets of ``points[i:]`` with `j`
+    items summing to `s`, for totals up to `high`. Counts are exact Python
+    ints, they overflow any fixed width for realistic problem banks.
+    """
+    n = len(points)
+    top = min(high, sum(sorted(points, reverse=True)[:k]))
+    table = np.zeros((k + 1, top + 1), dtype=object)
+    table[0, 0] = 1
+    counts = [table]
+    for p in reversed(points):
+        table = table.copy()
+        if p <= top:
+            table[1:, p:] += counts[-1][:-1, :top + 1 - p]
+        counts.append(table)
+    counts.reverse()
+    return counts
+
+def sample_subset(points, k, low, high, generator):
+    """
+    Indices of `k` of the `points` totalling in [low, high], uniformly over
+    all such subsets and in random order.
+
+    Runs in time bounded by the size of the count table and raises
+    ValueError if no subset fits.
+    """
+    if k < 0 or k > len(points):
+        raise ValueError(f'cannot choose {k} of {len(points)} items')
+    if any(p != int(p) or p < 0 for p in points):
+        raise ValueError('points must be non-negative integers')
+    points = [int(p) for p in points]
+    high = int(np.floor(high))
+    low = max(int(np.ceil(low)), 0)
+    if high < low:
+        raise ValueError(f'no subset of {k} totals in [{low}, {high}]')
+    counts = subset_counts(points, k, high)
+    weights = counts[0][k, low:]
+    if not any(weights):
+        raise ValueError(f'no subset of {k} totals in [{low}, {high}]')
+    x = randbelow(sum(weights), generator)
+    total = low
+    for w in weights:
+        if x < w:
+            break
+        x -= w
+        total += 1
+    chosen = []
+    for i, p in enumerate(points):
+        if k == 0:
+            break
+        if p <= total and randbelow(counts[i][k, total], generator) < counts[i + 1][k - 1, total - p]:
+            chosen.append(i)
+            k -= 1
+            total -= p
+    return [chosen[i] for i in generator.permutation(len(chosen))]
+
+def compositions(sizes, k, total):
+    """
+    The ways to take `k` items totalling `total` from classes of items of
+    equal points, `sizes` mapping points to the number of items.
+
+    Yields dicts mapping points to the number of items taken.
+    """
+    classes = sorted(sizes)
+    def extend(j, k, total):
+        if j == len(classes):
+            if k == 0 and total == 0:
+                yield {}
+            return
+        p = classes[j]
+        for c in range(min(sizes[p], k) + 1):
+            if c*p > total:
+                break
+            for rest in extend(j + 1, k - c, total - c*p):
+                yield {p: c, **rest} if c else rest
+    return extend(0, k, total)
+
+def texfmt(arraylike):
+    """
+    The LaTeX of a variable value, a pmatrix for a 1 or 2 dimensional
+    array. Gives exactly what the template's texfmt used to.
+    """
+    if type(arraylike) == np.ndarray:
+        if len(arraylike.shape) == 1:
+            body = '\\\\'.join(str(x) for x in arraylike)
+        elif len(arraylike.shape) == 2:
+            body = ''.join('&'.join(str(x) for x in row) + '\\\\' for row in arraylike)
+        else:
+            body = ''
+        return '\\begin{pmatrix}\n' + body + '\\end{pmatrix}\n'
+    return ('' if arraylike is None else str(arraylike)) + '\n'